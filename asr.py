@@ -0,0 +1,239 @@
+"""
+ASR Module
+Pluggable speech recognition engines: Google (online) and Vosk (offline, streaming)
+"""
+import json
+import os
+import queue
+import threading
+
+import lazy
+
+sr = lazy.lazy_import("speech_recognition")
+vosk = lazy.lazy_import("vosk")
+np = lazy.lazy_import("numpy")
+
+
+SAMPLE_RATE = 16000
+DEFAULT_ENGINE = "google"
+# Unpacked model from https://alphacephei.com/vosk/models
+DEFAULT_VOSK_MODEL = os.path.join("models", "vosk-model-small-en-us-0.15")
+
+
+def audio_data_from_array(recording, fs=SAMPLE_RATE):
+    """Wrap an int16 recording as sr.AudioData without going through a WAV file.
+
+    Only the first channel is used. sounddevice output is already contiguous
+    little-endian int16, so the AudioData frame data is a view over the NumPy
+    buffer rather than a copy.
+    """
+    samples = recording[:, 0] if recording.ndim == 2 else recording
+    samples = np.ascontiguousarray(samples, dtype='<i2')
+    return sr.AudioData(memoryview(samples).cast('B'), fs, samples.dtype.itemsize)
+
+
+def _pcm_bytes(recording):
+    """First channel of an int16 recording as little-endian PCM bytes"""
+    samples = recording[:, 0] if recording.ndim == 2 else recording
+    return np.ascontiguousarray(samples, dtype='<i2').tobytes()
+
+
+class ASREngine:
+    """Speech recognition backend.
+
+    `recognize(recording, fs)` transcribes a finished int16 recording and
+    returns the text, or None if nothing was understood. Engines with
+    `streaming = True` also provide `stream(fs)`, which returns a
+    RecognitionStream that decodes audio while it is still being captured.
+    """
+
+    name = "base"
+    streaming = False
+
+    def available(self):
+        return True
+
+    def load(self):
+        """Load models ahead of the first utterance (no-op by default)"""
+
+    def recognize(self, recording, fs=SAMPLE_RATE):
+        raise NotImplementedError
+
+    def stream(self, fs=SAMPLE_RATE, on_partial=None):
+        raise NotImplementedError(f"{self.name} does not support streaming recognition")
+
+
+class RecognitionStream:
+    """One utterance being recognised incrementally.
+
+    feed() is called from the audio callback with each captured block and only
+    queues it; decoding happens on a background thread so the callback never
+    waits. result() returns the transcript once the queued audio is decoded.
+    """
+
+    def __init__(self, on_partial=None):
+        self.partial = ""
+        self._on_partial = on_partial
+        self._blocks = queue.Queue()
+        self._text = None
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, name="megan-asr-stream", daemon=True)
+        self._thread.start()
+
+    def feed(self, block):
+        # Copy: sounddevice reuses the callback buffer
+        self._blocks.put(_pcm_bytes(block))
+
+    def result(self, timeout=None):
+        """Finish the utterance; returns the transcript or None"""
+        if not self._finished:
+            self._finished = True
+            self._blocks.put(None)
+        self._thread.join(timeout)
+        return self._text
+
+    def _run(self):
+        while True:
+            data = self._blocks.get()
+            if data is None:
+                break
+            partial = self._accept(data)
+            if partial is not None and partial != self.partial:
+                self.partial = partial
+                if self._on_partial is not None:
+                    self._on_partial(partial)
+        self._text = self._finish() or None
+
+    def _accept(self, data):
+        """Decode a chunk of PCM bytes; returns the partial transcript so far"""
+        raise NotImplementedError
+
+    def _finish(self):
+        """Flush the decoder; returns the full transcript"""
+        raise NotImplementedError
+
+
+class GoogleASR(ASREngine):
+    """Google Web Speech API via speech_recognition (network round trip per utterance)"""
+
+    name = "google"
+
+    def __init__(self):
+        self._recognizer = None
+
+    def available(self):
+        return lazy.available(sr)
+
+    def load(self):
+        if self._recognizer is None:
+            r = sr.Recognizer()
+            r.energy_threshold = 10
+            r.dynamic_energy_threshold = False
+            self._recognizer = r
+        return self._recognizer
+
+    def recognize(self, recording, fs=SAMPLE_RATE):
+        try:
+            return self.load().recognize_google(audio_data_from_array(recording, fs), language='en-US')
+        except sr.UnknownValueError:
+            print("\nCould not understand. Try again.")
+        except sr.RequestError as e:
+            print(f"\nSpeech service error: {e}")
+        return None
+
+
+def _vosk_text(result, key="text"):
+    return json.loads(result).get(key, "").strip()
+
+
+class VoskStream(RecognitionStream):
+    def __init__(self, recognizer, on_partial=None):
+        self._recognizer = recognizer
+        self._segments = []
+        super().__init__(on_partial)
+
+    def _accept(self, data):
+        if self._recognizer.AcceptWaveform(data):
+            # Vosk closed a segment at a pause; keep it and start the next one
+            text = _vosk_text(self._recognizer.Result())
+            if text:
+                self._segments.append(text)
+            return " ".join(self._segments)
+        partial = _vosk_text(self._recognizer.PartialResult(), "partial")
+        return " ".join(self._segments + [partial] if partial else self._segments)
+
+    def _finish(self):
+        text = _vosk_text(self._recognizer.FinalResult())
+        if text:
+            self._segments.append(text)
+        return " ".join(self._segments)
+
+
+class VoskASR(ASREngine):
+    """Offline Kaldi-based recognition. The model is loaded once and stays resident;
+    each utterance only creates a lightweight recognizer over it.
+    """
+
+    name = "vosk"
+    streaming = True
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path or os.getenv("MEGAN_VOSK_MODEL") or DEFAULT_VOSK_MODEL
+        self._model = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return os.path.isdir(self.model_path) and lazy.available(vosk)
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                vosk.SetLogLevel(-1)
+                self._model = vosk.Model(self.model_path)
+        return self._model
+
+    def recognize(self, recording, fs=SAMPLE_RATE):
+        recognizer = vosk.KaldiRecognizer(self.load(), fs)
+        recognizer.AcceptWaveform(_pcm_bytes(recording))
+        text = _vosk_text(recognizer.FinalResult())
+        if not text:
+            print("\nCould not understand. Try again.")
+        return text or None
+
+    def stream(self, fs=SAMPLE_RATE, on_partial=None):
+        return VoskStream(vosk.KaldiRecognizer(self.load(), fs), on_partial)
+
+
+ENGINES = {
+    "google": GoogleASR,
+    "vosk": VoskASR,
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+_selected = None
+
+
+def get_engine(name=None):
+    """Shared engine instance by name (default: the selected engine, MEGAN_ASR, or google)"""
+    name = (name or _selected or os.getenv("MEGAN_ASR") or DEFAULT_ENGINE).lower()
+    if name not in ENGINES:
+        raise ValueError(f"unknown ASR engine '{name}' (choose from {', '.join(ENGINES)})")
+    with _engines_lock:
+        engine = _engines.get(name)
+        if engine is None:
+            engine = _engines[name] = ENGINES[name]()
+    return engine
+
+
+def select_engine(name=None):
+    """Make `name` the default engine, falling back to Google if it can't be used"""
+    global _selected
+    engine = get_engine(name)
+    if not engine.available() and engine.name != DEFAULT_ENGINE:
+        print(f"[WARNING] ASR engine '{engine.name}' not available; using {DEFAULT_ENGINE}.")
+        if engine.name == "vosk":
+            print(f"          Install vosk and unpack a model to {engine.model_path} (or set MEGAN_VOSK_MODEL).")
+        engine = get_engine(DEFAULT_ENGINE)
+    _selected = engine.name
+    return engine
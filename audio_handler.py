@@ -2,124 +2,358 @@
 Audio Handler Module
 Handles microphone recording and speech recognition
 """
-import tempfile
-from scipy.io import wavfile
+import functools
+import threading
+import time
 
-try:
-    import speech_recognition as sr
-except:
-    sr = None
+import asr
+import lazy
+import tracing
+from asr import audio_data_from_array
+from emotion_detector import EmotionStream
 
-try:
-    import sounddevice as sd
-except:
-    sd = None
+# Imported on first use (or by the start-up warm-up thread)
+sr = lazy.lazy_import("speech_recognition")
+sd = lazy.lazy_import("sounddevice")
+np = lazy.lazy_import("numpy")
 
-try:
-    import numpy as np
-except:
-    np = None
 
+# Capture settings
+SAMPLE_RATE = 16000
+INPUT_DEVICE = 1  # Microphone Array
+FIXED_DURATION = 3  # seconds, used when streaming capture is disabled
 
-def listen_and_recognize(prompt="You: ", text_fallback=True, use_voice=True):
+# Streaming capture / voice-activity detection settings
+BLOCK_MS = 30  # callback block size
+VAD_THRESHOLD = 300  # int16 RMS level treated as speech
+BARGE_IN_THRESHOLD = 900  # while Megan speaks: loud enough to be the user, not her echo
+MIN_SPEECH_MS = 60  # voiced time needed before an utterance starts
+PRE_ROLL_S = 0.3  # audio kept from before speech onset
+HANGOVER_S = 0.8  # trailing silence that ends an utterance
+MAX_UTTERANCE_S = 15  # hard cap on utterance length
+LISTEN_TIMEOUT_S = 8  # give up if nobody starts speaking
+
+
+class _RingBuffer:
+    """Fixed-capacity int16 sample buffer addressed by absolute sample index."""
+
+    def __init__(self, capacity):
+        self._buf = np.zeros(capacity, dtype='int16')
+        self.capacity = capacity
+        self.written = 0
+
+    def write(self, block):
+        n = len(block)
+        if n >= self.capacity:
+            block = block[-self.capacity:]
+            self.written += n - self.capacity
+            n = self.capacity
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = block[:first]
+        self._buf[:n - first] = block[first:]
+        self.written += n
+
+    def read(self, start, stop):
+        """Copy samples [start, stop) out of the buffer (oldest samples may be gone)."""
+        start = max(start, self.written - self.capacity, 0)
+        stop = min(stop, self.written)
+        if stop <= start:
+            return np.zeros(0, dtype='int16')
+        idx = np.arange(start, stop) % self.capacity
+        return self._buf[idx]
+
+
+class EnergyVAD:
+    """Block-level energy voice-activity detector.
+
+    Speech starts after `min_speech_blocks` consecutive blocks above
+    `threshold` and ends after `hangover_blocks` consecutive quiet blocks.
+    """
+
+    def __init__(self, threshold=VAD_THRESHOLD, min_speech_blocks=2, hangover_blocks=27):
+        self.threshold = threshold
+        self.min_speech_blocks = min_speech_blocks
+        self.hangover_blocks = hangover_blocks
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self.speech_start = None
+        self._voiced = 0
+        self._silent = 0
+        self._candidate = None
+
+    def is_voiced(self, block):
+        samples = block.astype('float32')
+        return float(np.sqrt(np.mean(samples * samples))) > self.threshold
+
+    def update(self, block, position):
+        """Feed one block starting at absolute sample `position`.
+
+        Returns "start", "end" or None.
+        """
+        voiced = len(block) > 0 and self.is_voiced(block)
+        if not self.in_speech:
+            if voiced:
+                if self._voiced == 0:
+                    self._candidate = position
+                self._voiced += 1
+                if self._voiced >= self.min_speech_blocks:
+                    self.in_speech = True
+                    self.speech_start = self._candidate
+                    self._silent = 0
+                    return "start"
+            else:
+                self._voiced = 0
+            return None
+
+        if voiced:
+            self._silent = 0
+            return None
+        self._silent += 1
+        if self._silent >= self.hangover_blocks:
+            self.in_speech = False
+            return "end"
+        return None
+
+
+class StreamingRecorder:
+    """Capture one utterance from an InputStream, ended by trailing silence."""
+
+    def __init__(self, fs=SAMPLE_RATE, device=INPUT_DEVICE, max_duration=MAX_UTTERANCE_S,
+                 pre_roll=PRE_ROLL_S, hangover=HANGOVER_S, threshold=VAD_THRESHOLD,
+                 block_ms=BLOCK_MS, gate=None, asr_engine=None, barge_in_threshold=BARGE_IN_THRESHOLD,
+                 on_speech=None, track_emotion=True):
+        self.fs = fs
+        self.device = device
+        # Echo gate: while gate() is true (Megan is speaking) an utterance only
+        # starts above barge_in_threshold, so her own voice doesn't trigger it
+        self.gate = gate
+        self.threshold = threshold
+        self.barge_in_threshold = barge_in_threshold
+        # Called on the recording thread as soon as speech starts (before it ends)
+        self.on_speech = on_speech
+        # Streaming ASR engine fed with the utterance while it is captured (from
+        # the recording thread; the audio callback only stores blocks)
+        self.asr_engine = asr_engine if asr_engine is not None and asr_engine.streaming else None
+        # Emotion statistics are accumulated while capturing (also from the recording
+        # thread), ready when the utterance ends
+        self.track_emotion = track_emotion
+        self.blocksize = int(fs * block_ms / 1000)
+        self.max_samples = int(max_duration * fs)
+        self.pre_roll_samples = int(pre_roll * fs)
+        self.vad = EnergyVAD(
+            threshold=threshold,
+            min_speech_blocks=max(1, round(MIN_SPEECH_MS / block_ms)),
+            hangover_blocks=max(1, round(hangover * 1000 / block_ms)),
+        )
+        capacity = self.pre_roll_samples + self.max_samples + self.blocksize
+        self._ring = _RingBuffer(capacity)
+
+    def _reset(self):
+        self._ring.written = 0
+        self.vad.reset()
+        self._start = None
+        self._stop = None
+        self._fed = None  # end of the audio handed to the streams so far
+        self._stream = None
+        self._emotion = None
+        self._done = threading.Event()
+        self._wake = threading.Event()  # speech started or capture finished
+
+    def _callback(self, indata, frames, time_info, status):
+        if self._done.is_set():
+            return
+        block = indata[:, 0]
+        position = self._ring.written
+        self._ring.write(block)
+        if self._start is None:
+            gated = self.gate is not None and self.gate()
+            self.vad.threshold = self.barge_in_threshold if gated else self.threshold
+        event = self.vad.update(block, position)
+
+        if event == "start":
+            self._start = max(0, self.vad.speech_start - self.pre_roll_samples)
+        if self._start is not None:
+            self._wake.set()  # new audio for the recording thread
+
+        if event == "end":
+            self._stop = self._ring.written
+            self._done.set()
+            self._wake.set()
+            return
+
+        if self._start is not None and self._ring.written - self._start >= self.max_samples:
+            self._stop = self._start + self.max_samples
+            self._done.set()
+            self._wake.set()
+
+    def _feed_streams(self):
+        """Hand the audio captured since the last call to the streaming ASR engine
+        and the EmotionStream.
+
+        Runs on the recording thread, so starting the recognizer (and loading
+        its model) and the spectral analysis never hold up the audio callback.
+        """
+        if self._start is None or (self.asr_engine is None and not self.track_emotion):
+            return
+        if self._fed is None:
+            self._fed = self._start
+            if self.asr_engine is not None:
+                self._stream = self.asr_engine.stream(self.fs)
+            if self.track_emotion:
+                self._emotion = EmotionStream(self.fs)
+        stop = self._start + self.max_samples
+        stop = min(stop, self._stop if self._stop is not None else self._ring.written)
+        if stop > self._fed:
+            captured = self._ring.read(self._fed, stop)
+            self._fed = stop
+            if self._stream is not None:
+                self._stream.feed(captured)
+            if self._emotion is not None:
+                self._emotion.feed(captured)
+
+    def record(self, timeout=LISTEN_TIMEOUT_S):
+        """Block until an utterance is captured.
+
+        Returns an int16 array shaped (n, 1) like `sd.rec`, or None if no
+        speech started within `timeout` seconds.
+        """
+        self._reset()
+        with sd.InputStream(samplerate=self.fs, blocksize=self.blocksize, device=self.device,
+                            channels=1, dtype='int16', callback=self._callback):
+            deadline = time.monotonic() + timeout
+            notified = False
+            while True:
+                self._wake.wait(0.05)
+                self._wake.clear()
+                if self._start is not None and not notified:
+                    notified = True
+                    if self.on_speech is not None:
+                        self.on_speech()
+                self._feed_streams()
+                if self._done.is_set():
+                    break
+                if self._start is None and time.monotonic() >= deadline:
+                    return None
+        self._feed_streams()
+
+        recording = self._ring.read(self._start, self._stop).reshape(-1, 1)
+        if self._stream is not None or self._emotion is not None:
+            # Most of the utterance is already decoded and analysed; recognize() and
+            # analyze_emotion_from_audio() just collect the results
+            recording = recording.view(_recording_class())
+            recording.asr_stream = self._stream
+            recording.emotion_stream = self._emotion
+        return recording
+
+
+@functools.lru_cache(maxsize=None)
+def _recording_class():
+    # Defined on first use so numpy stays a lazy import
+    class Recording(np.ndarray):
+        """int16 recording carrying the recognition and emotion streams that listened to it"""
+        asr_stream = None
+        emotion_stream = None
+    return Recording
+
+
+def voice_input_available():
+    """True if microphone capture and speech recognition can be used"""
+    return lazy.available(sr) and lazy.available(sd) and lazy.available(np)
+
+
+def record_utterance(streaming=True, gate=None, timeout=LISTEN_TIMEOUT_S, fs=SAMPLE_RATE, asr_engine=None,
+                     on_speech=None):
+    """Record one utterance from the microphone.
+    Returns an int16 array shaped (n, 1), or None if nobody spoke.
+    With a streaming `asr_engine` the audio is recognised while it is captured;
+    `on_speech()` is called as soon as the utterance starts.
+    """
+    with tracing.span("record", streaming=streaming) as span:
+        if streaming:
+            recorder = StreamingRecorder(fs=fs, gate=gate, asr_engine=asr_engine, on_speech=on_speech)
+            recording = recorder.record(timeout=timeout)
+        else:
+            recording = sd.rec(int(FIXED_DURATION * fs), samplerate=fs, channels=1, dtype='int16',
+                               device=INPUT_DEVICE, blocking=True)
+            sd.wait()
+        span.set("speech_ms", None if recording is None else round(len(recording) * 1000 / fs))
+    return recording
+
+
+def report_audio_level(recording):
+    """Print the recording level and warn when it is too quiet to recognise"""
+    max_amplitude = np.max(np.abs(recording))
+    avg_amplitude = np.mean(np.abs(recording))
+    print(f"[Audio level: max={max_amplitude}, avg={avg_amplitude:.1f}]")
+    
+    if max_amplitude < 100:
+        print(f"[WARNING] Very low audio volume detected. Speak louder or check your microphone.")
+
+
+def recognize(recording, fs=SAMPLE_RATE, engine=None):
+    """Transcribe a recording with the selected ASR engine (Google by default).
+    Recordings captured with a streaming engine just collect its result.
+    Returns the text, or None if it could not be understood or the service failed.
+    """
+    stream = getattr(recording, "asr_stream", None)
+    engine = engine or asr.get_engine()
+    with tracing.span("asr", engine=engine.name, streamed=stream is not None) as span:
+        if stream is not None:
+            text = stream.result()
+            if not text:
+                print("\nCould not understand. Try again.")
+        else:
+            text = engine.recognize(recording, fs)
+        span.set("result", "text" if text else "none")
+    return text
+
+
+def listen_and_recognize(prompt="You: ", text_fallback=True, use_voice=True, streaming=True):
     """Listen using microphone and return (transcript, audio_data).
     Falls back to text input returning (text, None) if SpeechRecognition or microphone not available.
+    With streaming=True the utterance ends on trailing silence instead of a fixed 3-second window.
     """
     # If voice is disabled, go straight to text input
     if not use_voice:
         txt = input(prompt)
         return txt, None
     
-    # Use a loop instead of recursion. Try SR microphone, then sounddevice VAD, then text input.
+    # Use a loop instead of recursion. Try the microphone a few times, then text input.
     attempts = 0
     max_attempts = 3
-    while True:
+    while attempts < max_attempts:
         attempts += 1
-
-        # Try speech_recognition microphone if available
-        if sr is not None:
-            try:
-                # Use sounddevice to record since PyAudio is missing
-                if sd is not None and np is not None:
-                    print(prompt, end="", flush=True)
-                    print("Listening for 3 seconds...")
-                    
-                    duration = 3
-                    fs = 16000
-                    
-                    # Stop any audio playback before recording
-                    try:
-                        sd.stop()
-                    except:
-                        pass
-                    
-                    # Use device 1 (default microphone)
-                    recording = sd.rec(int(duration * fs), samplerate=fs, channels=1, dtype='int16', device=1, blocking=True)
-                    sd.wait()
-                    
-                    # Check recording volume
-                    max_amplitude = np.max(np.abs(recording))
-                    avg_amplitude = np.mean(np.abs(recording))
-                    print(f"[Audio level: max={max_amplitude}, avg={avg_amplitude:.1f}]")
-                    
-                    if max_amplitude < 100:
-                        print(f"[WARNING] Very low audio volume detected. Speak louder or check your microphone.")
-                    
-                    # Save audio to temporary file for better recognition
-                    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-                        wavfile.write(temp_wav.name, fs, recording)
-                        temp_filename = temp_wav.name
-                    
-                    r = sr.Recognizer()
-                    r.energy_threshold = 10
-                    r.dynamic_energy_threshold = False
-                    
-                    try:
-                        with sr.AudioFile(temp_filename) as source:
-                            audio_data = r.record(source)
-                        text = r.recognize_google(audio_data, language='en-US')
-                        print(f"\nYou said: {text}")
-                        
-                        # Clean up temp file
-                        try:
-                            import os
-                            os.unlink(temp_filename)
-                        except:
-                            pass
-                        
-                        return text, recording
-                    except sr.UnknownValueError:
-                        print("\nCould not understand. Try again.")
-                        if attempts >= max_attempts:
-                            pass  # Fall through to text input
-                        else:
-                            continue
-                    except sr.RequestError as e:
-                        print(f"\nSpeech service error: {e}")
-                        if attempts >= max_attempts:
-                            pass
-                        else:
-                            continue
-                else:
-                    # sounddevice not available, skip SR method
-                    if attempts >= max_attempts:
-                        break
-                    else:
-                        continue
-            except Exception as e:
-                print(f"\nRecognition error: {e}")
-                if attempts >= max_attempts:
-                    break
-                else:
-                    continue
-
-        # Fallback to text input after max attempts
-        if attempts >= max_attempts:
-            if text_fallback:
-                print("\nSwitching to text input...")
-                txt = input(prompt)
-                # If empty input, try again once
-                if not txt.strip():
-                    txt = input(prompt)
-                return txt, None
-            raise RuntimeError("No available audio input method")
+        
+        # Use sounddevice to record since PyAudio is missing
+        if not voice_input_available():
+            break
+        
+        try:
+            print(prompt, end="", flush=True)
+            print("Listening..." if streaming else f"Listening for {FIXED_DURATION} seconds...")
+            
+            recording = record_utterance(streaming=streaming)
+            if recording is None:
+                print("\nNo speech detected. Try again.")
+                continue
+            
+            report_audio_level(recording)
+            text = recognize(recording)
+            if text:
+                print(f"\nYou said: {text}")
+                return text, recording
+        except Exception as e:
+            print(f"\nRecognition error: {e}")
+    
+    # Fallback to text input after max attempts
+    if text_fallback:
+        print("\nSwitching to text input...")
+        txt = input(prompt)
+        # If empty input, try again once
+        if not txt.strip():
+            txt = input(prompt)
+        return txt, None
+    raise RuntimeError("No available audio input method")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Batch Module
+Headless processing of a directory of WAV files through the MEGAN pipeline
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numpy as np
+except:
+    np = None
+
+from emotion_detector import analyze_emotion_from_audio
+from local_responses import get_response as local_responder
+from text_to_speech import TTS_POOL_SIZE, TTSPool, is_tts_available
+from wav_decoder import open_wav
+
+STAGES = ("decode", "emotion", "asr", "respond", "tts", "total")
+
+# Per-process state, created on first use inside each worker
+_gemini_client = None
+
+
+def read_wav(path):
+    """Read a WAV file (path or file object) as (int16 samples of the first channel, sample rate)"""
+    wav = open_wav(path)
+    return wav.to_int16(), wav.framerate
+
+
+def find_wav_files(corpus):
+    """All .wav files under `corpus`, sorted"""
+    paths = []
+    for root, _, files in os.walk(corpus):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(".wav"))
+    return sorted(paths)
+
+
+def _recognize(samples, framerate, path, asr):
+    if asr != "none":
+        # Engines are per process, so an offline model loads once per worker
+        from asr import get_engine
+        from audio_handler import recognize
+        return recognize(samples, framerate, engine=get_engine(asr))
+    # Offline runs read a reference transcript next to the audio (utt.wav -> utt.txt)
+    transcript = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(transcript):
+        with open(transcript, encoding="utf-8") as f:
+            return f.read().strip()
+    return None
+
+
+def _respond(text, emotion, responder):
+    global _gemini_client
+    if responder == "gemini":
+        from gemini_client import ConversationHistory, GeminiClient
+        if _gemini_client is None:
+            _gemini_client = GeminiClient()
+        # Utterances are independent; don't carry history between files
+        _gemini_client.history = ConversationHistory()
+        reply = _gemini_client.send_message(text, emotion)
+        if reply is not None:
+            return reply, "gemini"
+    return local_responder(text, emotion), "local"
+
+
+def _save_speech(result, job, tts_dir, corpus):
+    """Write a finished render under `tts_dir` (mirroring the file's path
+    below `corpus`) and record its timing"""
+    data = job.wait()
+    timings = result["timings_ms"]
+    if job.render_time is not None:
+        timings["tts"] = round(job.render_time * 1000, 3)
+        timings["total"] = round(timings["total"] + timings["tts"], 3)
+    if data is None:
+        result["error"] = f"TTS {job.status}"
+        return
+    relative = os.path.relpath(result["file"], corpus)
+    out_path = os.path.join(tts_dir, os.path.splitext(relative)[0] + ".wav")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "wb") as f:
+        f.write(data)
+    result["tts_file"] = out_path
+
+
+def process_file(path, asr="google", responder="local"):
+    """Run one WAV file through every stage but speech synthesis; returns a
+    JSON-serialisable result (replies are rendered by the parent's TTS pool)"""
+    result = {"file": path}
+    timings = {}
+    start = time.perf_counter()
+    try:
+        t = time.perf_counter()
+        samples, framerate = read_wav(path)
+        timings["decode"] = time.perf_counter() - t
+        result["duration_s"] = len(samples) / framerate
+
+        t = time.perf_counter()
+        emotion = analyze_emotion_from_audio(samples, framerate)
+        timings["emotion"] = time.perf_counter() - t
+        result["emotion"] = str(emotion)
+        result["emotion_confidence"] = round(emotion.confidence, 3)
+
+        t = time.perf_counter()
+        text = _recognize(samples, framerate, path, asr)
+        timings["asr"] = time.perf_counter() - t
+        result["transcript"] = text
+
+        if text:
+            t = time.perf_counter()
+            result["response"], result["responder"] = _respond(text, emotion, responder)
+            timings["respond"] = time.perf_counter() - t
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    timings["total"] = time.perf_counter() - start
+    result["timings_ms"] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+    return result
+
+
+def summarize(results, wall_time, workers):
+    """Print throughput and per-stage latency percentiles"""
+    n = len(results)
+    errors = sum(1 for r in results if "error" in r)
+    print(f"\nProcessed {n} utterances in {wall_time:.2f}s "
+          f"({n / wall_time if wall_time else 0:.2f} utterances/sec, {workers} workers, {errors} errors)")
+    print(f"{'stage':<10}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage in STAGES:
+        values = [r["timings_ms"][stage] for r in results if stage in r["timings_ms"]]
+        if not values:
+            continue
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        print(f"{stage:<10}{len(values):>7}{p50:>10.1f}{p90:>10.1f}{p99:>10.1f}{max(values):>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="megan.py batch",
+        description="Run a directory of WAV files through emotion analysis, speech recognition and the responder."
+    )
+    parser.add_argument("corpus", help="directory of .wav files (searched recursively)")
+    parser.add_argument("-o", "--out", default="batch_results.jsonl", help="JSONL results file")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--asr", choices=["google", "vosk", "none"], default="google",
+                        help="'vosk' recognises offline; 'none' reads reference transcripts "
+                             "from <name>.txt next to each WAV")
+    parser.add_argument("--responder", choices=["local", "gemini"], default="local")
+    parser.add_argument("--tts-dir", help="also synthesize each response to a WAV file in this directory")
+    parser.add_argument("--tts-workers", type=int, default=TTS_POOL_SIZE, help="TTS render processes (with --tts-dir)")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("[ERROR] numpy is required for batch mode.")
+        return 1
+
+    paths = find_wav_files(args.corpus)
+    if not paths:
+        print(f"[ERROR] No .wav files found in {args.corpus}")
+        return 1
+    if args.tts_dir and not is_tts_available():
+        print("[ERROR] Text-to-speech not available; cannot write --tts-dir.")
+        return 1
+    tts_pool = None
+    if args.tts_dir:
+        os.makedirs(args.tts_dir, exist_ok=True)
+        tts_pool = TTSPool(args.tts_workers)
+        tts_pool.start()
+
+    workers = max(1, min(args.workers, len(paths)))
+    print(f"Processing {len(paths)} files with {workers} workers...")
+    results = []
+    start = time.perf_counter()
+    # Spawned, not forked: the TTS pool's threads are already running in this process
+    context = multiprocessing.get_context("spawn")
+    with open(args.out, "w", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(process_file, path, args.asr, args.responder) for path in paths]
+        # Replies are queued on the TTS pool as soon as they exist (waiting while its
+        # queue is full) and written out once every file has been analysed
+        rendering = []
+        for future in as_completed(futures):
+            result = future.result()
+            if tts_pool is not None and result.get("response"):
+                rendering.append((result, tts_pool.submit(result["response"], deadline=None)))
+                continue
+            results.append(result)
+            out.write(json.dumps(result) + "\n")
+        for result, job in rendering:
+            _save_speech(result, job, args.tts_dir, args.corpus)
+            results.append(result)
+            out.write(json.dumps(result) + "\n")
+    wall_time = time.perf_counter() - start
+    if tts_pool is not None:
+        tts_pool.shutdown()
+
+    summarize(results, wall_time, workers)
+    print(f"Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,85 +2,248 @@
 Emotion Detector Module
 Analyzes audio to detect emotional state
 """
-import io
-import wave
-import struct
+import lazy
+import tracing
+import wav_decoder
+from emotion_model import EmotionResult, feature_vector, get_classifier
+from spectral_features import (
+    RunningMoments, SpectralStream, as_float32, extract_spectral_features, extract_spectral_features_batch
+)
 
-try:
-    import numpy as np
-except:
-    np = None
+np = lazy.lazy_import("numpy")
 
 
-def analyze_emotion_from_audio(audio) -> str:
+# Sliding-window analysis frame (25 ms window, 10 ms hop)
+FRAME_MS = 25
+HOP_MS = 10
+
+# Column layout of the per-frame feature matrix
+FRAME_FEATURES = ("energy", "zcr", "amp_mean", "amp_std")
+
+
+class AudioFeatures:
+    """Per-frame and whole-utterance features for one recording.
+
+    `frames` is an (n_frames, len(FRAME_FEATURES)) matrix; `energy`, `zcr`
+    and `amp_std` are the global values the threshold rules read. `spectral`
+    holds MFCC/pitch/centroid/flux features when they were requested.
+    """
+
+    def __init__(self, frames, energy, zcr, amp_std, framerate, hop_length, spectral=None):
+        self.frames = frames
+        self.energy = energy
+        self.zcr = zcr
+        self.amp_std = amp_std
+        self.framerate = framerate
+        self.hop_length = hop_length
+        self.spectral = spectral
+
+    def frame_feature(self, name):
+        """Return one column of the per-frame matrix by name."""
+        return self.frames[:, FRAME_FEATURES.index(name)]
+
+
+def extract_features(audio_array, framerate=16000, frame_ms=FRAME_MS, hop_ms=HOP_MS, spectral=False):
+    """Compute energy, zero-crossing rate and amplitude statistics
+    (plus spectral features with spectral=True).
+
+    Per-sample terms are computed once over the whole utterance; the global
+    aggregates come straight from them, and the per-frame matrix is a strided
+    view over the same arrays, so no Python-level loop touches the samples.
+    """
+    x = np.asarray(audio_array, dtype='float32').reshape(-1)
+    N = len(x)
+
+    squared = x ** 2
+    magnitude = np.abs(x)
+    # Sign change between consecutive samples (x >= 0 counts as positive)
+    negative = x < 0
+    crossings = negative[1:] != negative[:-1]
+
+    energy = np.sum(squared) / N
+    zcr = np.count_nonzero(crossings) / N
+    amp_std = np.std(magnitude)
+
+    frame_length = max(1, int(framerate * frame_ms / 1000))
+    hop_length = max(1, int(framerate * hop_ms / 1000))
+    if N < frame_length:
+        frame_length = N
+
+    windows = np.lib.stride_tricks.sliding_window_view
+    frame_squared = windows(squared, frame_length)[::hop_length]
+    frame_magnitude = windows(magnitude, frame_length)[::hop_length]
+    # Crossings inside a frame: frame_length - 1 sample pairs
+    if frame_length > 1:
+        frame_crossings = windows(crossings, frame_length - 1)[::hop_length]
+        frame_zcr = np.count_nonzero(frame_crossings, axis=1) / frame_length
+    else:
+        frame_zcr = np.zeros(len(frame_squared))
+
+    frames = np.column_stack((
+        frame_squared.mean(axis=1),
+        frame_zcr,
+        frame_magnitude.mean(axis=1),
+        frame_magnitude.std(axis=1),
+    )).astype('float32')
+
+    features = AudioFeatures(frames, energy, zcr, amp_std, framerate, hop_length)
+    if spectral:
+        features.spectral = extract_spectral_features(x, framerate)
+    return features
+
+
+def _audio_to_array(audio, framerate=16000):
+    """Return (float32 samples in [-1, 1), framerate) for supported inputs."""
+    if isinstance(audio, np.ndarray):
+        # Direct numpy array from sounddevice (int16)
+        audio_array = audio.flatten().astype('float32') / 32768.0
+        return audio_array, framerate
+
+    # AudioData object from speech_recognition: view its PCM buffer directly
+    # (objects that only provide get_wav_data() are decoded from the WAV bytes)
+    if hasattr(audio, "frame_data"):
+        wav = wav_decoder.from_pcm(audio.frame_data, audio.sample_rate, audio.sample_width)
+    else:
+        wav = wav_decoder.decode(audio.get_wav_data())
+    return wav.to_float32(), wav.framerate
+
+
+class EmotionStream:
+    """Emotion analysis of an utterance fed block by block while it is captured.
+
+    Energy, zero-crossing and amplitude statistics are running totals and
+    the spectral summary comes from a SpectralStream, so memory stays
+    constant however long the utterance runs and result() is ready the
+    moment capture ends. The features match extract_features(...,
+    spectral=True) on the whole recording.
+    """
+
+    def __init__(self, framerate=16000):
+        self.framerate = framerate
+        self.samples = 0
+        self._sum_squared = 0.0
+        self._crossings = 0
+        self._last_negative = None
+        self._magnitude = RunningMoments()
+        self._spectral = SpectralStream(framerate)
+
+    def feed(self, block):
+        """Add int16 or float samples"""
+        x = as_float32(block)
+        if not len(x):
+            return
+        negative = x < 0
+        self._crossings += int(np.count_nonzero(negative[1:] != negative[:-1]))
+        if self._last_negative is not None and self._last_negative != negative[0]:
+            self._crossings += 1
+        self._last_negative = bool(negative[-1])
+        self._sum_squared += float(np.dot(x, x))
+        self._magnitude.update(np.abs(x))
+        self.samples += len(x)
+        self._spectral.feed(x)
+
+    def vector(self):
+        """Feature vector laid out as emotion_model.FEATURE_NAMES"""
+        return np.concatenate((
+            [self._sum_squared / self.samples, self._crossings / self.samples, self._magnitude.std],
+            self._spectral.vector(),
+        )).astype('float32')
+
+    def result(self, classifier=None):
+        """Classify what has been fed so far"""
+        if not self.samples:
+            return EmotionResult("unknown")
+        try:
+            vector = self.vector()
+            label, confidence = (classifier or get_classifier()).predict(vector)
+            return EmotionResult.from_vector(label, confidence, vector)
+        except Exception as e:
+            return EmotionResult("unknown", error=e)
+
+
+@tracing.traced("emotion")
+def analyze_emotion_from_audio(audio, framerate=16000) -> EmotionResult:
     """Extract spectral features for emotion classification.
     Accepts either numpy array (from sounddevice) or AudioData object.
+    `framerate` applies to numpy input; AudioData carries its own.
+    Recordings captured with an EmotionStream just classify its totals.
     """
     if audio is None:
-        return "unknown"
+        return EmotionResult("unknown")
+    stream = getattr(audio, "emotion_stream", None)
+    if stream is not None:
+        return stream.result()
 
     try:
-        # Handle different audio input types
-        if isinstance(audio, np.ndarray):
-            # Direct numpy array from sounddevice (int16)
-            audio_array = audio.flatten().astype('float32') / 32768.0
-            framerate = 16000  # Default sample rate
-        else:
-            # AudioData object from speech_recognition
-            wav_bytes = audio.get_wav_data()
-            with wave.open(io.BytesIO(wav_bytes), 'rb') as wf:
-                n_channels = wf.getnchannels()
-                sampwidth = wf.getsampwidth()
-                framerate = wf.getframerate()
-                n_frames = wf.getnframes()
-                frames = wf.readframes(n_frames)
-
-            # Unpack samples (assume 16-bit PCM)
-            if sampwidth == 2:
-                fmt = '<{n}h'.format(n=(len(frames) // 2))
-                samples = struct.unpack(fmt, frames)
-            else:
-                samples = list(frames)
-
-            # If stereo, take only one channel
-            if n_channels == 2:
-                samples = samples[::2]
-
-            # Convert to numpy array and normalize
-            audio_array = np.array(samples, dtype='float32') / 32768.0
-        
-        N = len(audio_array)
-        if N == 0:
-            return "unknown"
-        
-        # Calculate energy and pitch variation
-        energy = np.sum(audio_array ** 2) / N
-        
-        # Calculate zero-crossing rate (pitch variation indicator)
-        zero_crossings = 0
-        for i in range(1, N):
-            if (audio_array[i] >= 0 and audio_array[i-1] < 0) or (audio_array[i] < 0 and audio_array[i-1] >= 0):
-                zero_crossings += 1
-        zcr = zero_crossings / N
-        
-        # Calculate amplitude variance (loudness changes)
-        amp_std = np.std(np.abs(audio_array))
-        
-        # Classify emotion based on energy, pitch variation, and amplitude dynamics
-        # Calibrated thresholds - adjusted for better sensitivity
-        
-        # Angry/Excited: Higher energy OR strong amplitude variation
-        if (energy > 0.0040 and amp_std > 0.045) or energy > 0.0080:
-            emotion = "angry/excited"
-        # Happy/Energetic: Moderate energy range
-        elif energy > 0.0020 and energy <= 0.0040 and amp_std > 0.025:
-            emotion = "happy/energetic"
-        # Sad/Quiet: Very low energy
-        elif energy < 0.0015:
-            emotion = "sad/quiet"
-        else:
-            emotion = "neutral"
-
-        return emotion + f" (energy={energy:.4f}, zcr={zcr:.3f}, amp_std={amp_std:.3f})"
+        audio_array, framerate = _audio_to_array(audio, framerate)
+        if len(audio_array) == 0:
+            return EmotionResult("unknown")
+
+        features = extract_features(audio_array, framerate, spectral=True)
+        vector = feature_vector(features)
+        label, confidence = get_classifier().predict(vector)
+        return EmotionResult.from_vector(label, confidence, vector)
     except Exception as e:
-        return f"unknown (error: {e})"
+        return EmotionResult("unknown", error=e)
+
+
+def _global_features(clips):
+    """energy, zcr and amp_std arrays for non-empty float clips.
+
+    The clips are concatenated once and every statistic is a segmented sum
+    (np.add.reduceat) over the joined samples, matching extract_features().
+    """
+    lengths = np.array([len(clip) for clip in clips])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    x = np.concatenate(clips)
+
+    squared = x * x
+    energy = np.add.reduceat(squared, offsets, dtype='float64') / lengths
+    amp_mean = np.add.reduceat(np.abs(x), offsets, dtype='float64') / lengths
+    # |x|^2 == x^2, so the variance of the magnitude needs no second pass
+    amp_std = np.sqrt(np.maximum(energy - amp_mean ** 2, 0.0))
+
+    negative = x < 0
+    crossings = np.zeros(len(x), dtype=bool)
+    crossings[:-1] = negative[1:] != negative[:-1]
+    # Pairs that straddle two clips aren't crossings
+    crossings[offsets[1:] - 1] = False
+    zcr = np.add.reduceat(crossings, offsets, dtype='int64') / lengths
+    return energy, zcr, amp_std
+
+
+def analyze_emotions(clips, framerate=16000, lengths=None, classifier=None):
+    """Classify many utterances at once; returns one EmotionResult per clip.
+
+    `clips` is a list of 1-D int16/float arrays, or a padded 2-D array whose
+    rows are clips (`lengths` gives each row's valid samples; default: the
+    full row). All clips share `framerate`. Features are computed in one
+    batched pass and scored with a single classifier call; empty clips give
+    an "unknown" result.
+    """
+    if lengths is not None or (isinstance(clips, np.ndarray) and clips.ndim == 2):
+        clips = np.asarray(clips)
+        if lengths is None:
+            lengths = [clips.shape[1]] * len(clips)
+        clips = [row[:int(n)] for row, n in zip(clips, lengths)]
+    clips = [as_float32(clip) for clip in clips]
+
+    results = [EmotionResult("unknown") for _ in clips]
+    present = [i for i, clip in enumerate(clips) if len(clip)]
+    if not present:
+        return results
+
+    voiced = [clips[i] for i in present]
+    energy, zcr, amp_std = _global_features(voiced)
+    spectral = extract_spectral_features_batch(voiced, framerate)
+    matrix = np.column_stack((
+        energy, zcr, amp_std,
+        np.stack([features.vector() for features in spectral]),
+    )).astype('float32')
+
+    classifier = classifier or get_classifier()
+    scores = classifier.scores(matrix)
+    best = np.argmax(scores, axis=1)
+    for row, i in enumerate(present):
+        results[i] = EmotionResult.from_vector(classifier.labels[best[row]], scores[row, best[row]], matrix[row])
+    return results
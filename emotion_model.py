@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Emotion Model Module
+Emotion classifiers over the utterance feature vector, a compact .npz model format and a training CLI
+"""
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+import zipfile
+from enum import Enum
+from functools import lru_cache
+
+import lazy
+from spectral_features import SUMMARY_NAMES
+
+np = lazy.lazy_import("numpy")
+
+
+class Emotion(Enum):
+    """Emotion category the responders dispatch on.
+
+    The value is the key local responses are indexed by; `label` (also the
+    str() form) is the name shown to the user and given to Gemini.
+    """
+
+    ANGRY = "angry"
+    HAPPY = "happy"
+    NEUTRAL = "neutral"
+    SAD = "sad"
+
+    @property
+    def label(self):
+        return _EMOTION_LABELS[self]
+
+    def __str__(self):
+        return _EMOTION_LABELS[self]
+
+    @classmethod
+    def of(cls, emotion):
+        """Emotion for an Emotion, EmotionResult, label string or None (neutral)"""
+        if isinstance(emotion, Emotion):
+            return emotion
+        if emotion is None:
+            return Emotion.NEUTRAL
+        if isinstance(emotion, EmotionResult):
+            return emotion.emotion
+        return _parse_emotion(str(emotion))
+
+
+_EMOTION_LABELS = {
+    Emotion.ANGRY: "angry/excited",
+    Emotion.HAPPY: "happy/energetic",
+    Emotion.NEUTRAL: "neutral",
+    Emotion.SAD: "sad/quiet",
+}
+
+# Labels the built-in classifiers produce
+LABELS = tuple(_EMOTION_LABELS.values())
+
+
+@lru_cache(maxsize=64)
+def _parse_emotion(text):
+    # Labels from trained models and older display strings ("sad/quiet (energy=...)")
+    base = text.split('(')[0].strip().lower()
+    if "angry" in base or "excited" in base:
+        return Emotion.ANGRY
+    if "sad" in base or "quiet" in base:
+        return Emotion.SAD
+    if "happy" in base or "energetic" in base:
+        return Emotion.HAPPY
+    return Emotion.NEUTRAL
+
+
+# Layout of feature_vector(): global time-domain features, then the spectral summary
+FEATURE_NAMES = ("energy", "zcr", "amp_std") + SUMMARY_NAMES
+ENERGY, ZCR, AMP_STD = range(3)
+
+DEFAULT_MODEL = os.path.join("models", "emotion_model.npz")
+FORMAT_VERSION = 1
+
+
+class EmotionResult:
+    """Emotion analysis of one utterance, carried from the analyser to the responders.
+
+    `label` is what the classifier said (a trained model may use its own
+    names), `emotion` the Emotion it maps to, and `features` maps
+    FEATURE_NAMES to values (empty when nothing was analysed). str() gives
+    the display form with the headline metrics.
+    """
+
+    __slots__ = ("label", "emotion", "confidence", "features", "error")
+
+    def __init__(self, label, confidence=0.0, features=None, error=None):
+        self.label = label
+        self.emotion = _parse_emotion(label)
+        self.confidence = confidence
+        self.features = features or {}
+        self.error = error
+
+    @classmethod
+    def from_vector(cls, label, confidence, vector):
+        return cls(label, float(confidence), dict(zip(FEATURE_NAMES, vector.tolist())))
+
+    def __str__(self):
+        if self.error is not None:
+            return f"{self.label} (error: {self.error})"
+        f = self.features
+        if not f:
+            return self.label
+        return (f"{self.label} (energy={f['energy']:.4f}, zcr={f['zcr']:.3f}, "
+                f"amp_std={f['amp_std']:.3f}, pitch={f['pitch_mean']:.0f}Hz)")
+
+    def __repr__(self):
+        return f"EmotionResult({self.label!r}, confidence={self.confidence:.2f})"
+
+
+# Weight of the newest turn in a session's smoothed emotion
+TRAJECTORY_ALPHA = 0.25
+
+
+class EmotionTrajectory:
+    """Exponentially smoothed emotion of a conversation, one update per measured turn.
+
+    Keeps a decaying score per Emotion (constant memory however long the
+    session runs); each turn adds its confidence to the emotion it detected.
+    """
+
+    def __init__(self, alpha=TRAJECTORY_ALPHA):
+        self.alpha = alpha
+        self.scores = dict.fromkeys(Emotion, 0.0)
+        self.turns = 0
+        self.latest = None
+
+    def update(self, result):
+        """Add one turn's EmotionResult"""
+        emotion = Emotion.of(result)
+        for key in self.scores:
+            self.scores[key] *= 1.0 - self.alpha
+        self.scores[emotion] += self.alpha * (result.confidence or 1.0)
+        self.turns += 1
+        self.latest = emotion
+
+    def dominant(self):
+        """The emotion with the highest smoothed score, or None before the first turn"""
+        if not self.turns:
+            return None
+        return max(self.scores, key=self.scores.get)
+
+    def describe(self):
+        """Short description for the responder, e.g. "mostly sad/quiet, now neutral over 4 turns" """
+        dominant = self.dominant()
+        if dominant is None:
+            return None
+        text = f"mostly {dominant.label}"
+        if self.latest is not dominant:
+            text += f", now {self.latest.label}"
+        return f"{text} over {self.turns} turns"
+
+
+def feature_vector(features):
+    """float32 vector laid out as FEATURE_NAMES from emotion_detector.AudioFeatures"""
+    if features.spectral is None:
+        raise ValueError("feature vector needs spectral features (extract_features(..., spectral=True))")
+    return np.concatenate((
+        [features.energy, features.zcr, features.amp_std],
+        features.spectral.vector(),
+    )).astype('float32')
+
+
+def _threshold_classes(energy, amp_std):
+    """Index into LABELS for each (energy, amp_std) pair; works on whole columns"""
+    energy = np.asarray(energy)
+    amp_std = np.asarray(amp_std)
+    # Calibrated thresholds - adjusted for better sensitivity; first match wins
+    return np.select(
+        [
+            # Angry/Excited: Higher energy OR strong amplitude variation
+            ((energy > 0.0040) & (amp_std > 0.045)) | (energy > 0.0080),
+            # Happy/Energetic: Moderate energy range
+            (energy > 0.0020) & (energy <= 0.0040) & (amp_std > 0.025),
+            # Sad/Quiet: Very low energy
+            energy < 0.0015,
+        ],
+        [LABELS.index("angry/excited"), LABELS.index("happy/energetic"), LABELS.index("sad/quiet")],
+        default=LABELS.index("neutral"),
+    )
+
+
+def classify_emotion(energy, amp_std):
+    """Map whole-utterance features to an emotion label."""
+    return LABELS[int(_threshold_classes(energy, amp_std))]
+
+
+class EmotionClassifier:
+    """Maps feature vectors (FEATURE_NAMES layout) to emotion labels.
+
+    `scores(matrix)` returns an (n, len(labels)) array of class probabilities
+    for an (n, n_features) matrix; `predict(vector)` returns (label, confidence)
+    for one utterance.
+    """
+
+    name = "base"
+    labels = LABELS
+
+    def scores(self, matrix):
+        raise NotImplementedError
+
+    def predict(self, vector):
+        probabilities = self.scores(np.asarray(vector, dtype='float32')[None, :])[0]
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+
+class ThresholdClassifier(EmotionClassifier):
+    """The hand-tuned energy / amplitude thresholds (no model file needed)"""
+
+    name = "thresholds"
+
+    def scores(self, matrix):
+        matrix = np.asarray(matrix)
+        result = np.zeros((len(matrix), len(self.labels)), dtype='float32')
+        result[np.arange(len(matrix)), _threshold_classes(matrix[:, ENERGY], matrix[:, AMP_STD])] = 1.0
+        return result
+
+
+class LogisticRegression(EmotionClassifier):
+    """Multinomial logistic regression.
+
+    Standardisation is folded into `weights` (n_labels, n_features) and `bias`
+    at training time, so scoring is one matrix product and a softmax straight
+    over the (possibly memory-mapped) arrays.
+    """
+
+    name = "logistic"
+
+    def __init__(self, labels, weights, bias, feature_names=FEATURE_NAMES):
+        self.labels = tuple(labels)
+        self.weights = weights
+        self.bias = bias
+        self.feature_names = tuple(feature_names)
+
+    def scores(self, matrix):
+        logits = np.asarray(matrix, dtype='float32') @ self.weights.T + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= logits.sum(axis=1, keepdims=True)
+        return logits
+
+    def save(self, path):
+        """Write an uncompressed .npz (stored members can be memory-mapped by load())"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                kind=np.array(self.name),
+                version=np.array(FORMAT_VERSION),
+                labels=np.array(self.labels),
+                feature_names=np.array(self.feature_names),
+                weights=np.ascontiguousarray(self.weights, dtype='float32'),
+                bias=np.ascontiguousarray(self.bias, dtype='float32'),
+            )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["labels"].tolist(), np.asarray(arrays["weights"]), np.asarray(arrays["bias"]),
+                   arrays["feature_names"].tolist())
+
+
+# Model kinds that can be stored in the .npz format
+MODEL_KINDS = {
+    "logistic": LogisticRegression,
+}
+
+
+def _npy_offset(f, info):
+    """File offset of a stored member's array header, from its local zip header"""
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise ValueError(f"corrupt zip header for {info.filename}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def load_npz(path, mmap=True):
+    """{name: array} from an .npz file without unpickling anything.
+
+    Members that are stored uncompressed are memory-mapped in place (the OS
+    pages them in on first use and shares them between processes); compressed
+    members are read into memory.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            f.seek(_npy_offset(f, info))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"{info.filename}: object arrays are not supported")
+            offset = f.tell()
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                                         order="F" if fortran_order else "C")
+    return arrays
+
+
+def load_model(path, mmap=True):
+    """Load a classifier saved with save(); raises ValueError for an incompatible file"""
+    arrays = load_npz(path, mmap)
+    kind = str(arrays["kind"][()]) if "kind" in arrays else None
+    if kind not in MODEL_KINDS:
+        raise ValueError(f"unknown model kind '{kind}'")
+    if int(arrays["version"][()]) > FORMAT_VERSION:
+        raise ValueError(f"model format {int(arrays['version'][()])} is newer than this version of MEGAN")
+    if tuple(arrays["feature_names"].tolist()) != FEATURE_NAMES:
+        raise ValueError("model was trained on a different feature layout; retrain it")
+    return MODEL_KINDS[kind].from_arrays(arrays)
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def load_classifier(path=None):
+    """The trained model at `path` (default MEGAN_EMOTION_MODEL or models/emotion_model.npz),
+    falling back to the threshold rules if there is none or it can't be used
+    """
+    path = path or os.getenv("MEGAN_EMOTION_MODEL") or DEFAULT_MODEL
+    if not os.path.exists(path):
+        return ThresholdClassifier()
+    try:
+        return load_model(path)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        print(f"[WARNING] Emotion model {path} not usable ({e}); using threshold rules.")
+        return ThresholdClassifier()
+
+
+def get_classifier():
+    """Shared classifier, loaded on first use"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = load_classifier()
+    return _classifier
+
+
+def set_classifier(classifier):
+    """Replace the shared classifier (None reloads it on next use)"""
+    global _classifier
+    _classifier = classifier
+
+
+def train_logistic(matrix, targets, labels, l2=1e-3, iterations=2000, learning_rate=0.5):
+    """Fit multinomial logistic regression by full-batch gradient descent.
+
+    `targets` are indices into `labels`. Features are standardised for the
+    fit and classes are weighted inversely to their frequency.
+    """
+    x = np.asarray(matrix, dtype='float64')
+    targets = np.asarray(targets)
+    n, k = len(x), len(labels)
+
+    mean = x.mean(axis=0)
+    scale = x.std(axis=0)
+    scale[scale == 0] = 1.0
+    z = (x - mean) / scale
+
+    onehot = np.zeros((n, k))
+    onehot[np.arange(n), targets] = 1.0
+    counts = onehot.sum(axis=0)
+    sample_weight = (n / (np.count_nonzero(counts) * np.maximum(counts, 1)))[targets][:, None]
+
+    weights = np.zeros((k, x.shape[1]))
+    bias = np.zeros(k)
+    for _ in range(iterations):
+        logits = z @ weights.T + bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        error = sample_weight * (probabilities - onehot) / n
+        weights -= learning_rate * (error.T @ z + l2 * weights)
+        bias -= learning_rate * error.sum(axis=0)
+
+    # Fold the standardisation in, so the model scores raw feature vectors
+    weights /= scale
+    bias -= weights @ mean
+    return LogisticRegression(labels, weights.astype('float32'), bias.astype('float32'))
+
+
+def label_for_directory(name):
+    """Directory name -> label ('angry' and 'excited' both mean 'angry/excited')"""
+    name = name.lower()
+    for label in LABELS:
+        if name == label.replace("/", "_") or name in label.split("/"):
+            return label
+    return name
+
+
+def load_dataset(data_dir, verbose=True):
+    """Feature matrix, label indices and labels from <data_dir>/<label>/*.wav"""
+    from batch import find_wav_files
+    from emotion_detector import extract_features
+    from wav_decoder import open_wav
+
+    directories = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    labels = sorted({label_for_directory(d) for d in directories})
+    rows, targets = [], []
+    for directory in directories:
+        paths = find_wav_files(os.path.join(data_dir, directory))
+        label = label_for_directory(directory)
+        for path in paths:
+            wav = open_wav(path)
+            if len(wav) == 0:
+                continue
+            features = extract_features(wav.to_float32(), wav.framerate, spectral=True)
+            rows.append(feature_vector(features))
+            targets.append(labels.index(label))
+        if verbose:
+            print(f"  {directory:<20} -> {label:<16} {len(paths)} files")
+    if not rows:
+        raise ValueError(f"no labelled .wav files under {data_dir} (expected <label>/*.wav)")
+    return np.stack(rows), np.array(targets), labels
+
+
+def evaluate(classifier, matrix, targets, labels):
+    """Accuracy overall and per true label"""
+    predicted = [classifier.labels[i] for i in np.argmax(classifier.scores(matrix), axis=1)]
+    truth = [labels[i] for i in targets]
+    correct = np.array([p == t for p, t in zip(predicted, truth)])
+    per_label = {label: float(correct[[t == label for t in truth]].mean())
+                 for label in labels if label in truth}
+    return float(correct.mean()), per_label
+
+
+def _print_evaluation(name, classifier, matrix, targets, labels):
+    accuracy, per_label = evaluate(classifier, matrix, targets, labels)
+    details = ", ".join(f"{label} {value:.0%}" for label, value in per_label.items())
+    print(f"  {name:<12} accuracy {accuracy:.1%}  ({details})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the MEGAN emotion classifier.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="fit a model on <data_dir>/<label>/*.wav")
+    train.add_argument("data_dir")
+    train.add_argument("-o", "--out", default=DEFAULT_MODEL, help="model file (.npz)")
+    train.add_argument("--holdout", type=float, default=0.2, help="fraction held out for evaluation")
+    train.add_argument("--l2", type=float, default=1e-3, help="L2 regularisation")
+    train.add_argument("--iterations", type=int, default=2000)
+    train.add_argument("--seed", type=int, default=0)
+
+    test = commands.add_parser("evaluate", help="score a model on <data_dir>/<label>/*.wav")
+    test.add_argument("data_dir")
+    test.add_argument("-m", "--model", default=DEFAULT_MODEL)
+    args = parser.parse_args(argv)
+
+    print(f"Extracting features from {args.data_dir}...")
+    try:
+        matrix, targets, labels = load_dataset(args.data_dir)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return 1
+    unknown = [label for label in labels if label not in LABELS]
+    if unknown:
+        print(f"[WARNING] Labels {', '.join(unknown)} are not among {', '.join(LABELS)}; "
+              "local responses will treat them as neutral.")
+
+    if args.command == "evaluate":
+        classifier = load_model(args.model)
+        _print_evaluation(classifier.name, classifier, matrix, targets, labels)
+        _print_evaluation("thresholds", ThresholdClassifier(), matrix, targets, labels)
+        return 0
+
+    order = np.random.default_rng(args.seed).permutation(len(matrix))
+    n_test = int(len(matrix) * args.holdout)
+    test_rows, train_rows = order[:n_test], order[n_test:]
+
+    start = time.perf_counter()
+    classifier = train_logistic(matrix[train_rows], targets[train_rows], labels, args.l2, args.iterations)
+    print(f"Trained on {len(train_rows)} utterances in {time.perf_counter() - start:.1f}s")
+    _print_evaluation("train", classifier, matrix[train_rows], targets[train_rows], labels)
+    if n_test:
+        _print_evaluation("holdout", classifier, matrix[test_rows], targets[test_rows], labels)
+        _print_evaluation("thresholds", ThresholdClassifier(), matrix[test_rows], targets[test_rows], labels)
+
+    # Final model uses every utterance
+    if n_test:
+        classifier = train_logistic(matrix, targets, labels, args.l2, args.iterations)
+    classifier.save(args.out)
+    print(f"Model written to {args.out} ({os.path.getsize(args.out)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,33 +2,396 @@
 Gemini AI Client Module
 Handles Gemini API interaction
 """
+import asyncio
+import copy
+import hashlib
 import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
 
-try:
-    import google.generativeai as genai
-except:
-    genai = None
+import lazy
+import tracing
+from emotion_model import Emotion, EmotionResult, EmotionTrajectory
+
+# The SDK pulls in grpc and protobuf; import it only once a client is configured
+genai = lazy.lazy_import("google.generativeai")
+
+
+# Request policy
+REQUEST_TIMEOUT_S = 15  # per attempt
+REQUEST_DEADLINE_S = 30  # whole request, including retries
+MAX_RETRIES = 3
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+
+# Circuit breaker: open after this many failed requests in a row, then allow
+# a trial request once the cooldown has passed
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN_S = 30
+
+
+class CircuitBreaker:
+    """Closed → open after repeated failures → half-open trial → closed again"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN_S, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+
+    def ready(self):
+        """True if a request would currently be let through"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return self._clock() - self._opened_at >= self.cooldown
+            return True
+
+    def allow(self):
+        """Claim permission for one request: False, True, or HALF_OPEN for the single trial.
+        Pass the claim to release() once the request is over."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                return self.HALF_OPEN
+            return False
+
+    def release(self, claim):
+        """End a request. A trial abandoned without a verdict (closed stream,
+        cancelled task) reopens the circuit with a fresh cooldown, so the next
+        trial can still happen."""
+        with self._lock:
+            if claim == self.HALF_OPEN and self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[WARNING] Gemini failing; pausing requests for {self.cooldown:.0f}s.")
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+
+
+def _status_code(e):
+    """HTTP status of an SDK error, if it carries one"""
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code
+    code = getattr(code, "value", None)
+    if isinstance(code, int) and code >= 100:
+        return code
+    error_msg = str(e)
+    for status in ("429", "500", "502", "503", "504", "404"):
+        if error_msg.startswith(status) or f" {status} " in f" {error_msg} ":
+            return int(status)
+    if "quota" in error_msg.lower():
+        return 429
+    return None
+
+
+def _error_name(e):
+    """Short label for a failed request in traces"""
+    return _status_code(e) or type(e).__name__
+
+
+def _is_retryable(e):
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status = _status_code(e)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff delay for retry number `attempt` (0-based)"""
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** attempt)))
+
+
+# Response cache
+CACHE_SIZE = 256
+CACHE_TTL_S = 6 * 3600
+
+# Prompts whose answer depends on when they are asked are never cached
+_TIME_SENSITIVE = re.compile(
+    r"\b(time|date|day|today|tonight|tomorrow|yesterday|now|current|currently|latest|"
+    r"news|weather|score|schedule|this (week|month|year))\b"
+)
+_EMOTION_CONTEXT = re.compile(r"^\[User emotion: ([^\]]*)\]\s*")
+
+
+def normalize_prompt(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """LRU + TTL cache of Gemini replies with an optional sqlite tier.
+
+    Keyed on the normalised user text, the base emotion taken from the
+    "[User emotion: ...]" prompt context and a digest of the conversation it
+    was asked in (ConversationHistory.digest()), so follow-ups such as "why?"
+    are only answered from the cache in the same context. With `path` set,
+    entries are also written to sqlite so a warm cache survives restarts.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL_S, path=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(prompt, context=""):
+        """Cache key for a full prompt asked after the history digest `context`,
+        or None if it must not be cached"""
+        match = _EMOTION_CONTEXT.match(prompt)
+        emotion = match.group(1).strip() if match else "neutral"
+        text = normalize_prompt(prompt[match.end():] if match else prompt)
+        if not text or _TIME_SENSITIVE.search(text):
+            return None
+        return f"{emotion}|{context}|{text}"
+
+    def get(self, prompt, context=""):
+        key = self.key(prompt, context)
+        with self._lock:
+            if key is None:
+                self.bypassed += 1
+                return None
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    entry = (row[0], row[1])
+                    self._store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, prompt, response, context=""):
+        key = self.key(prompt, context)
+        if key is None or not response:
+            return
+        entry = (response, self._clock())
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                    (key, entry[0], entry[1]),
+                )
+                self._db.execute("DELETE FROM responses WHERE created < ?", (entry[1] - self.ttl,))
+                self._db.commit()
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "size": len(self._entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+# Conversation history sent with each request
+HISTORY_TOKEN_BUDGET = 2000  # recent turns kept verbatim
+HISTORY_MAX_TURNS = 20
+SUMMARY_TOKEN_BUDGET = 300  # rolling summary of turns that fell out of the window
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token)"""
+    return (len(text) + 3) // 4
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+class ConversationHistory:
+    """Token-bounded chat history: a sliding window of recent turns plus a
+    rolling summary of older ones.
+
+    Turns that fall out of the window are condensed into one summary line
+    each (the user's words and the first sentence of the reply); the oldest
+    summary lines are dropped once the summary exceeds its own budget. So the
+    history sent with every request stays roughly constant in size however
+    long the session runs.
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, max_turns=HISTORY_MAX_TURNS,
+                 summary_budget=SUMMARY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_budget = summary_budget
+        self._turns = deque()  # (user, reply, tokens)
+        self._tokens = 0
+        self._summary = deque()  # (line, tokens)
+        self._summary_tokens = 0
+        self.summarized = 0
+        # Size of the most recent request, filled in by contents()/record_usage()
+        self.last_stats = None
+
+    def __len__(self):
+        return len(self._turns)
+
+    def add(self, user, reply):
+        """Record a completed exchange"""
+        tokens = estimate_tokens(user) + estimate_tokens(reply)
+        self._turns.append((user, reply, tokens))
+        self._tokens += tokens
+        while len(self._turns) > 1 and (
+            len(self._turns) > self.max_turns or self._tokens > self.token_budget
+        ):
+            old_user, old_reply, old_tokens = self._turns.popleft()
+            self._tokens -= old_tokens
+            self._summarize(old_user, old_reply)
+
+    def _summarize(self, user, reply):
+        match = _EMOTION_CONTEXT.match(user)
+        emotion = f" ({match.group(1).strip()})" if match else ""
+        text = user[match.end():] if match else user
+        first_sentence = re.split(r"(?<=[.!?])\s", reply.strip(), maxsplit=1)[0]
+        line = f"- User{emotion}: {_clip(text, 100)} / Megan: {_clip(first_sentence, 120)}"
+        tokens = estimate_tokens(line)
+        self._summary.append((line, tokens))
+        self._summary_tokens += tokens
+        self.summarized += 1
+        while len(self._summary) > 1 and self._summary_tokens > self.summary_budget:
+            self._summary_tokens -= self._summary.popleft()[1]
+
+    def digest(self):
+        """Short hash of the summary and turns sent before each prompt ("" while
+        the history is empty); part of the response cache key"""
+        if not self._turns and not self._summary:
+            return ""
+        h = hashlib.sha256()
+        for line, _ in self._summary:
+            h.update(line.encode("utf-8") + b"\0")
+        for user, reply, _ in self._turns:
+            h.update(user.encode("utf-8") + b"\0" + reply.encode("utf-8") + b"\0")
+        return h.hexdigest()[:16]
+
+    def contents(self, prompt, context=None):
+        """Request contents: summary, recent turns, then the new prompt (preceded
+        by `context`, which is sent this once and not kept in the history)"""
+        contents = []
+        if self._summary:
+            summary = "Summary of our earlier conversation:\n" + "\n".join(line for line, _ in self._summary)
+            contents.append({"role": "user", "parts": [summary]})
+            contents.append({"role": "model", "parts": ["Got it, I'll keep that in mind."]})
+        for user, reply, _ in self._turns:
+            contents.append({"role": "user", "parts": [user]})
+            contents.append({"role": "model", "parts": [reply]})
+        contents.append({"role": "user", "parts": [context, prompt] if context else [prompt]})
+
+        chars = sum(len(part) for content in contents for part in content["parts"])
+        self.last_stats = {
+            "turns": len(self._turns),
+            "summarized": self.summarized,
+            "prompt_chars": chars,
+            "prompt_tokens": self._summary_tokens + self._tokens + estimate_tokens(prompt)
+                             + (estimate_tokens(context) if context else 0),
+            "estimated": True,
+        }
+        return contents
+
+    def record_usage(self, response):
+        """Replace the estimate with the token count Gemini reports, if any"""
+        try:
+            count = response.usage_metadata.prompt_token_count
+        except Exception:
+            count = None
+        if self.last_stats is not None and count:
+            self.last_stats["prompt_tokens"] = count
+            self.last_stats["estimated"] = False
 
 
 class GeminiClient:
-    def __init__(self, api_key=None):
-        self.available = False
-        self.chat = None
+    def __init__(self, api_key=None, endpoint=None, breaker=None, cache=None, history=None):
+        self.enabled = False
         self.model = None
-        
-        if genai is None:
-            print("[WARNING] Gemini client not available; responses will be local fallback.")
-            return
-            
+        # Bounded history sent with each request (replaces an ever-growing chat session)
+        self.history = history or ConversationHistory()
+        # Smoothed emotion over the measured turns of this conversation
+        self.trajectory = EmotionTrajectory()
+        self.breaker = breaker or CircuitBreaker()
+        # Optional ResponseCache shared by all request methods
+        self.cache = cache
+        self._lock = threading.Lock()
+
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
-        
+        # Optional API endpoint override (e.g. a local fake server for testing)
+        self.endpoint = endpoint or os.getenv("GEMINI_API_ENDPOINT")
+
         if not self.api_key:
             print("[WARNING] GEMINI_API_KEY not set. Gemini responses disabled.")
             return
-            
+
+        if not lazy.available(genai):
+            print("[WARNING] Gemini client not available; responses will be local fallback.")
+            return
+
         try:
-            genai.configure(api_key=self.api_key)
-            
+            if self.endpoint:
+                genai.configure(api_key=self.api_key, transport="rest",
+                                client_options={"api_endpoint": self.endpoint})
+            else:
+                genai.configure(api_key=self.api_key)
+
             # Create model with system instruction for emotion-aware responses
             system_instruction = (
                 "You are Megan (spelled M-E-G-A-N), an empathetic voice assistant. "
@@ -38,44 +401,241 @@ class GeminiClient:
                 "When angry/excited: be calming and understanding. "
                 "When happy/energetic: match their enthusiasm. "
                 "When neutral: be helpful and friendly. "
+                "A note on how their emotion has developed over the conversation may precede "
+                "their message; let the trend, not just the latest turn, guide your tone. "
                 "Keep responses concise (2-3 sentences). "
                 "If asked about your name, mention that you are Megan, an emotion-aware voice assistant."
             )
-            
+
             self.model = genai.GenerativeModel(
                 "gemini-2.5-flash",
                 system_instruction=system_instruction
             )
-            self.chat = self.model.start_chat(history=[])
-            self.available = True
+            self.enabled = True
             print("[SUCCESS] Gemini AI connected with emotion-aware responses")
         except Exception as e:
             print(f"[WARNING] Could not initialize Gemini client: {e}")
-            self.available = False
-    
-    def send_message(self, message, emotion="neutral"):
+            self.enabled = False
+
+    def new_session(self):
+        """Client for another conversation: shares the model, circuit breaker and
+        cache with this one, but keeps its own history"""
+        session = copy.copy(self)
+        session.history = ConversationHistory()
+        session.trajectory = EmotionTrajectory()
+        session._lock = threading.Lock()
+        return session
+
+    @property
+    def available(self):
+        """True if Gemini is configured and the circuit breaker would let a request through"""
+        return self.enabled and self.breaker.ready()
+
+    def _prompt(self, message, emotion):
+        # Emotions measured from a recording also feed the session's trajectory
+        if isinstance(emotion, EmotionResult) and emotion.features and emotion.error is None:
+            with self._lock:
+                self.trajectory.update(emotion)
+        # Include emotion context in the prompt
+        emotion_context = f"[User emotion: {Emotion.of(emotion).label}] "
+        return emotion_context + message
+
+    def _trend(self):
+        # Sent beside the prompt rather than in it, so the response cache key
+        # (emotion + text) and the stored history stay as they were
+        if self.trajectory.turns < 2:
+            return None
+        return f"[Emotion over the conversation: {self.trajectory.describe()}]"
+
+    def _cached(self, prompt):
+        if self.cache is None:
+            return None
+        with self._lock:
+            context = self.history.digest()
+        with tracing.span("gemini.cache") as span:
+            text = self.cache.get(prompt, context)
+            span.set("hit", text is not None)
+        if text is not None:
+            with self._lock:
+                self.history.add(prompt, text)
+        return text
+
+    def _remember(self, prompt, text, response=None):
+        with self._lock:
+            context = self.history.digest()
+            self.history.add(prompt, text)
+            if response is not None:
+                self.history.record_usage(response)
+        if self.cache is not None:
+            self.cache.put(prompt, text, context)
+
+    def _handle_error(self, e):
+        """Log a failed request; returns True if it is worth retrying"""
+        status = _status_code(e)
+        if status == 404:
+            # Model not found - disable Gemini
+            print(f"[WARNING] Gemini model not found: {e}")
+            self.enabled = False
+            return False
+        if status == 429:
+            print("[WARNING] Gemini API quota exceeded. Backing off.")
+        elif isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+            print("[WARNING] Gemini request timed out.")
+        else:
+            print(f"Gemini error: {e}")
+        return _is_retryable(e)
+
+    def _send(self, prompt, timeout, stream=False):
+        # Only completed exchanges are added to the history, so a failed or
+        # abandoned request leaves nothing to clean up
+        with self._lock:
+            contents = self.history.contents(prompt, context=self._trend())
+        return self.model.generate_content(contents, stream=stream, request_options={"timeout": timeout})
+
+    def _attempts(self, deadline_end):
+        """Yield (attempt, per-attempt timeout) until retries or the deadline run out"""
+        for attempt in range(MAX_RETRIES + 1):
+            remaining = deadline_end - time.monotonic()
+            if remaining <= 0:
+                return
+            yield attempt, min(REQUEST_TIMEOUT_S, remaining)
+
+    def _retry_delay(self, attempt, deadline_end):
+        if attempt >= MAX_RETRIES:
+            return None
+        delay = _backoff(attempt)
+        if time.monotonic() + delay >= deadline_end:
+            return None
+        return delay
+
+    def send_message(self, message, emotion=Emotion.NEUTRAL, deadline=REQUEST_DEADLINE_S):
         """Send message to Gemini with emotion context"""
-        if not self.available:
+        if not self.enabled:
             return None
-            
+
+        prompt = self._prompt(message, emotion)
+        cached = self._cached(prompt)
+        if cached is not None:
+            return cached
+        claim = self.breaker.allow()
+        if not claim:
+            return None
+
         try:
-            # Extract base emotion (remove metrics in parentheses)
-            base_emotion = emotion.split('(')[0].strip() if '(' in emotion else emotion
-            
-            # Include emotion context in the prompt
-            emotion_context = f"[User emotion: {base_emotion}] "
-            full_prompt = emotion_context + message
-            
-            response = self.chat.send_message(full_prompt)
-            return response.text
-        except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "quota" in error_msg.lower():
-                print("[WARNING] Gemini API quota exceeded. Using local responses.")
-                self.available = False
-            elif "404" in error_msg:
-                # Model not found - disable Gemini
-                self.available = False
-            else:
-                print(f"Gemini error: {e}")
+            deadline_end = time.monotonic() + deadline
+            for attempt, timeout in self._attempts(deadline_end):
+                with tracing.span("gemini", attempt=attempt) as span:
+                    try:
+                        response = self._send(prompt, timeout)
+                        self.breaker.record_success()
+                        self._remember(prompt, response.text, response)
+                        return response.text
+                    except Exception as e:
+                        span.set("error", _error_name(e))
+                        retryable = self._handle_error(e)
+                if not retryable:
+                    break
+                delay = self._retry_delay(attempt, deadline_end)
+                if delay is None:
+                    break
+                time.sleep(delay)
+            self.breaker.record_failure()
+            return None
+        finally:
+            self.breaker.release(claim)
+
+    def stream_message(self, message, emotion=Emotion.NEUTRAL, deadline=REQUEST_DEADLINE_S):
+        """Send message to Gemini and yield the reply text as it is generated.
+        Yields nothing if Gemini is unavailable or fails before the first chunk.
+        Only failures before the first chunk are retried.
+        """
+        if not self.enabled:
+            return
+
+        prompt = self._prompt(message, emotion)
+        cached = self._cached(prompt)
+        if cached is not None:
+            yield cached
+            return
+        claim = self.breaker.allow()
+        if not claim:
+            return
+
+        try:
+            deadline_end = time.monotonic() + deadline
+            for attempt, timeout in self._attempts(deadline_end):
+                received = []
+                # The span is suspended with the generator, so it also covers the time
+                # the caller spends on each chunk; first_chunk_ms isolates the model
+                with tracing.span("gemini", attempt=attempt, stream=True) as span:
+                    sent = time.perf_counter()
+                    try:
+                        response = self._send(prompt, timeout, stream=True)
+                        for chunk in response:
+                            try:
+                                text = chunk.text
+                            except ValueError:
+                                # Chunk without text parts (e.g. final safety/finish metadata)
+                                continue
+                            if text:
+                                if not received:
+                                    span.set("first_chunk_ms", round((time.perf_counter() - sent) * 1000, 1))
+                                received.append(text)
+                                yield text
+                        span.set("chunks", len(received))
+                        self.breaker.record_success()
+                        self._remember(prompt, "".join(received), response)
+                        return
+                    except Exception as e:
+                        span.set("error", _error_name(e))
+                        retryable = self._handle_error(e)
+                if received or not retryable:
+                    break
+                delay = self._retry_delay(attempt, deadline_end)
+                if delay is None:
+                    break
+                time.sleep(delay)
+            self.breaker.record_failure()
+        finally:
+            self.breaker.release(claim)
+
+    async def send_message_async(self, message, emotion=Emotion.NEUTRAL, deadline=REQUEST_DEADLINE_S):
+        """Async send_message: awaits the reply with per-attempt timeouts, retries and backoff.
+        The blocking SDK call and the response cache (sqlite) run in worker threads so
+        the event loop never blocks on them.
+        """
+        if not self.enabled:
+            return None
+
+        prompt = self._prompt(message, emotion)
+        cached = await asyncio.to_thread(self._cached, prompt) if self.cache is not None else None
+        if cached is not None:
+            return cached
+        claim = self.breaker.allow()
+        if not claim:
+            return None
+
+        try:
+            deadline_end = time.monotonic() + deadline
+            for attempt, timeout in self._attempts(deadline_end):
+                with tracing.span("gemini", attempt=attempt, asynchronous=True) as span:
+                    try:
+                        response = await asyncio.wait_for(asyncio.to_thread(self._send, prompt, timeout), timeout)
+                        self.breaker.record_success()
+                        await asyncio.to_thread(self._remember, prompt, response.text, response)
+                        return response.text
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        span.set("error", _error_name(e))
+                        retryable = self._handle_error(e)
+                if not retryable:
+                    break
+                delay = self._retry_delay(attempt, deadline_end)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+            self.breaker.record_failure()
             return None
+        finally:
+            self.breaker.release(claim)
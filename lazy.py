@@ -0,0 +1,142 @@
+"""
+Lazy Import Module
+Defers heavy imports and engine probes until first use, and warms them up in the background
+"""
+import importlib
+import threading
+import time
+
+
+# name -> (seconds, thread name) for every lazy import and warm-up task that ran
+LOAD_TIMES = {}
+_times_lock = threading.Lock()
+
+
+def _record(name, seconds):
+    with _times_lock:
+        LOAD_TIMES[name] = (seconds, threading.current_thread().name)
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    Attributes are cached on the proxy once looked up, so hot paths pay the
+    indirection only once per name. Use `available()` instead of the usual
+    `module is None` check; it imports the module if that hasn't happened yet.
+    """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_error = None
+        self._lazy_loaded = False
+        self._lazy_lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        module = load(self)
+        if module is None:
+            raise ImportError(f"{self._lazy_name} is not available: {self._lazy_error}")
+        value = getattr(module, attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        state = "loaded" if self._lazy_loaded else "not loaded"
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_import(name):
+    """Return a LazyModule for `name` (e.g. lazy_import("numpy"))"""
+    return LazyModule(name)
+
+
+def load(module):
+    """Import a lazy module now; returns the real module, or None if it can't be imported"""
+    if module._lazy_loaded:
+        return module._lazy_module
+    with module._lazy_lock:
+        if not module._lazy_loaded:
+            start = time.perf_counter()
+            try:
+                module._lazy_module = importlib.import_module(module._lazy_name)
+            except Exception as e:
+                # Missing packages and broken native libraries (e.g. no PortAudio) alike
+                module._lazy_error = e
+            _record(module._lazy_name, time.perf_counter() - start)
+            module._lazy_loaded = True
+    return module._lazy_module
+
+
+def available(module):
+    """True if the lazy module can be imported"""
+    return load(module) is not None
+
+
+def is_loaded(module):
+    return module._lazy_loaded
+
+
+class Probe:
+    """A one-off check (such as initialising an engine) run at most once, on first use"""
+
+    def __init__(self, name, check):
+        self.name = name
+        self._check = check
+        self._result = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self._result is None:
+            with self._lock:
+                if self._result is None:
+                    start = time.perf_counter()
+                    try:
+                        self._result = bool(self._check())
+                    except Exception:
+                        self._result = False
+                    _record(self.name, time.perf_counter() - start)
+        return self._result
+
+    def set(self, result):
+        """Override the probe result (skips the check)"""
+        self._result = result
+
+
+def warm_up(*targets):
+    """Load lazy modules and run probes/callables on a background thread.
+
+    Each target is a LazyModule, a Probe, or a (name, callable) pair. Returns
+    the started thread; join it before relying on everything being ready.
+    """
+    def run():
+        for target in targets:
+            if isinstance(target, LazyModule):
+                load(target)
+            elif isinstance(target, Probe):
+                target()
+            else:
+                name, fn = target
+                start = time.perf_counter()
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"\n[WARNING] Warm-up of {name} failed: {e}")
+                _record(name, time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name="megan-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def report(extra=()):
+    """Print the import/probe cost table; `extra` adds (name, seconds, thread) rows"""
+    with _times_lock:
+        rows = [(name, seconds, thread) for name, (seconds, thread) in LOAD_TIMES.items()]
+    rows.extend(extra)
+    rows.sort(key=lambda row: row[1], reverse=True)
+    print("\n[Startup profile]")
+    print(f"  {'module / task':<28}{'ms':>9}  thread")
+    for name, seconds, thread in rows:
+        print(f"  {name:<28}{seconds * 1000:>9.1f}  {thread}")
@@ -2,82 +2,231 @@
 Local Responses Module
 Fallback responses when Gemini is not available
 """
+import re
 from datetime import datetime
 
+from emotion_model import Emotion
+
+
+class Intent:
+    """One knowledge-base entry.
+
+    `phrases` are word sequences that trigger the intent. `response` is a
+    string, a callable returning a string, or a dict keyed by emotion
+    ("angry", "sad", "happy", "neutral"). Question intents only fire when the
+    text contains a question word, and then only question intents (or ones
+    marked `in_questions`) can answer; all intents listed in `requires` must
+    also be matched somewhere in the text.
+    """
+
+    def __init__(self, name, phrases, response, question=False, requires=(), prefixed=True,
+                 in_questions=False):
+        self.name = name
+        self.phrases = phrases
+        self.response = response
+        self.question = question
+        self.in_questions = in_questions
+        self.requires = requires
+        self.prefixed = prefixed
+
+
+# Keyword sets used as conditions by other intents
+QUESTION_WORDS = Intent("question", ["who", "what", "when", "where", "why", "how"], None)
+INDIA = Intent("india", ["india"], None)
+
+# Knowledge base, highest priority first
+INTENTS = [
+    # Identity questions
+    Intent("identity", ["who are you", "what are you", "who r u", "hu r u"],
+           "I'm Megan, your emotion-aware voice assistant! I listen to your voice and respond based on how you're feeling.",
+           question=True),
+    Intent("name", ["your name", "what is your name"],
+           "My name is Megan - I'm your voice assistant who understands emotions!",
+           question=True),
+    Intent("creator", ["who created you", "who made you", "who developed you", "your creator", "your developer"],
+           "I'm an AI assistant designed to understand and respond to emotions in your voice.",
+           question=True),
+
+    # General knowledge questions
+    Intent("virat_kohli", ["virat kohli"],
+           "Virat Kohli is an Indian cricket captain and one of the best batsmen in the world!",
+           question=True),
+    Intent("tesla", ["nikola tesla", "tesla"],
+           "Nikola Tesla was a brilliant Serbian-American inventor and engineer, famous for his work on electricity and AC power systems!",
+           question=True),
+    Intent("einstein", ["einstein", "albert einstein"],
+           "Albert Einstein was a genius physicist who developed the theory of relativity and the famous equation E=mc²!",
+           question=True),
+    Intent("india_capital", ["capital"],
+           "The capital of India is New Delhi!",
+           question=True, requires=("india",)),
+    Intent("india_pm", ["pm of india", "prime minister of india"],
+           "The Prime Minister of India is Narendra Modi!",
+           question=True),
+    Intent("weather", ["weather"],
+           "I can't check the weather right now, but you can ask Google or check weather apps!",
+           question=True),
+    Intent("capabilities", ["what can you do", "what do you do"],
+           "I can chat with you, detect your emotions from your voice, and respond accordingly! Try talking in different tones.",
+           question=True),
+    Intent("time", ["time"],
+           lambda: "Current time is " + datetime.now().strftime("%H:%M:%S"),
+           question=True),
+    Intent("date", ["date"],
+           lambda: "Today is " + datetime.now().strftime("%B %d, %Y"),
+           question=True),
 
-def get_response(text: str, emotion: str = "neutral") -> str:
-    """Emotion-aware fallback responder when Gemini isn't available."""
-    t = text.lower()
-    
-    # Extract base emotion
-    base_emotion = emotion.split('(')[0].strip() if '(' in emotion else emotion
-    
-    # Emotion-aware prefixes
-    if "angry" in base_emotion or "excited" in base_emotion:
-        prefix = "I hear your intensity. "
-    elif "sad" in base_emotion or "quiet" in base_emotion:
-        prefix = "I'm here for you. "
-    elif "happy" in base_emotion or "energetic" in base_emotion:
-        prefix = "Love the energy! "
-    else:
-        prefix = ""
-    
-    # Answer specific questions
-    if "who" in t or "what" in t or "when" in t or "where" in t or "why" in t or "how" in t:
-        # Identity questions
-        if "who are you" in t or "what are you" in t or "who r u" in t or "hu r u" in t:
-            return prefix + "I'm Megan, your emotion-aware voice assistant! I listen to your voice and respond based on how you're feeling."
-        elif "your name" in t or "what is your name" in t:
-            return prefix + "My name is Megan - I'm your voice assistant who understands emotions!"
-        elif "who created you" in t or "who made you" in t or "who developed you" in t or "your creator" in t or "your developer" in t:
-            return prefix + "I'm an AI assistant designed to understand and respond to emotions in your voice."
-        
-        # General knowledge questions
-        elif "virat kohli" in t:
-            return prefix + "Virat Kohli is an Indian cricket captain and one of the best batsmen in the world!"
-        elif "nikola tesla" in t or "tesla" in t:
-            return prefix + "Nikola Tesla was a brilliant Serbian-American inventor and engineer, famous for his work on electricity and AC power systems!"
-        elif "einstein" in t or "albert einstein" in t:
-            return prefix + "Albert Einstein was a genius physicist who developed the theory of relativity and the famous equation E=mc²!"
-        elif "india" in t and "capital" in t:
-            return prefix + "The capital of India is New Delhi!"
-        elif "pm of india" in t or "prime minister of india" in t:
-            return prefix + "The Prime Minister of India is Narendra Modi!"
-        elif "weather" in t:
-            return prefix + "I can't check the weather right now, but you can ask Google or check weather apps!"
-        elif "what can you do" in t or "what do you do" in t:
-            return prefix + "I can chat with you, detect your emotions from your voice, and respond accordingly! Try talking in different tones."
-        elif "time" in t:
-            return prefix + "Current time is " + datetime.now().strftime("%H:%M:%S")
-        elif "date" in t:
-            return prefix + "Today is " + datetime.now().strftime("%B %d, %Y")
-        else:
-            return prefix + "That's an interesting question! I'm a simple assistant, so I might not know everything, but I'm here to chat with you!"
-    
-    # Greetings
-    if any(g in t for g in ["hello", "hi", "hey"]):
-        if "sad" in base_emotion or "quiet" in base_emotion:
-            return "Hey there! I'm here for you. Things will get better. What's on your mind?"
-        elif "angry" in base_emotion or "excited" in base_emotion:
-            return "Hello! I sense you're feeling intense. Let's talk it through. What's going on?"
-        elif "happy" in base_emotion or "energetic" in base_emotion:
-            return "Hey! Love the positive energy! What can I do for you today?"
-        else:
-            return "Hello! How can I help you today?"
-    
     # Check feelings
-    if "how are you" in t or "how r u" in t:
-        return prefix + "I'm doing well, thank you! More importantly, how are YOU feeling?"
-    
-    if "angry" in t or "mad" in t:
-        return prefix + "I'm not angry at all! I'm here to help you. What's bothering you?"
-    
-    # Default with emotion awareness
-    if "sad" in base_emotion or "quiet" in base_emotion:
-        return "I'm listening and I care. Remember, tough times don't last. What can I do to help?"
-    elif "angry" in base_emotion or "excited" in base_emotion:
-        return "I hear you. Let's work through this together. What would help right now?"
-    elif "happy" in base_emotion or "energetic" in base_emotion:
-        return "That's awesome! I'm excited to chat with you! What's on your mind?"
-    else:
-        return "I'm here to chat with you. What would you like to talk about?"
+    Intent("feelings", ["how are you", "how r u"],
+           "I'm doing well, thank you! More importantly, how are YOU feeling?",
+           in_questions=True),
+
+    # Greetings
+    Intent("greeting", ["hello", "hi", "hey"], {
+        "sad": "Hey there! I'm here for you. Things will get better. What's on your mind?",
+        "angry": "Hello! I sense you're feeling intense. Let's talk it through. What's going on?",
+        "happy": "Hey! Love the positive energy! What can I do for you today?",
+        "neutral": "Hello! How can I help you today?",
+    }, prefixed=False),
+
+    Intent("angry_at_me", ["angry", "mad"],
+           "I'm not angry at all! I'm here to help you. What's bothering you?"),
+]
+
+# Emotion-aware prefixes
+PREFIXES = {
+    "angry": "I hear your intensity. ",
+    "sad": "I'm here for you. ",
+    "happy": "Love the energy! ",
+    "neutral": "",
+}
+
+# Question nobody in the knowledge base answers
+UNKNOWN_QUESTION = "That's an interesting question! I'm a simple assistant, so I might not know everything, but I'm here to chat with you!"
+
+# Default with emotion awareness
+DEFAULTS = {
+    "sad": "I'm listening and I care. Remember, tough times don't last. What can I do to help?",
+    "angry": "I hear you. Let's work through this together. What would help right now?",
+    "happy": "That's awesome! I'm excited to chat with you! What's on your mind?",
+    "neutral": "I'm here to chat with you. What would you like to talk about?",
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class IntentMatcher:
+    """Word-level Aho-Corasick automaton over every intent phrase.
+
+    One left-to-right pass over the words of the text finds all phrase
+    matches (overlapping ones included) regardless of how many intents there
+    are; the winner is then the highest-priority intent whose conditions hold.
+    """
+
+    def __init__(self, intents, conditions=()):
+        self.intents = list(intents)
+        self._priority = {intent.name: i for i, intent in enumerate(self.intents)}
+        self._by_name = {intent.name: intent for intent in self.intents}
+
+        # Trie over word sequences: per-node transitions, failure links and outputs
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for intent in list(conditions) + self.intents:
+            for phrase in intent.phrases:
+                self._add(_WORD.findall(phrase.lower()), intent.name)
+        self._link()
+
+    def _add(self, words, name):
+        node = 0
+        for word in words:
+            nxt = self._goto[node].get(word)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][word] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            node = nxt
+        self._out[node].add(name)
+
+    def _link(self):
+        # Breadth-first failure links, merging outputs of the fallback node
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for word, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fallback = self._fail[node]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(word, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def scan(self, text):
+        """Return the names of every intent/condition with a phrase in `text`"""
+        found = set()
+        node = 0
+        for word in _WORD.findall(text.lower()):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            if self._out[node]:
+                found |= self._out[node]
+        return found
+
+    def match(self, text):
+        """Return (best intent or None, is_question)"""
+        found = self.scan(text)
+        is_question = QUESTION_WORDS.name in found
+        candidates = sorted((self._priority[name] for name in found if name in self._priority))
+        for index in candidates:
+            intent = self.intents[index]
+            # Questions go to question intents; anything else falls through to
+            # the generic question reply
+            if intent.question != is_question and not intent.in_questions:
+                continue
+            if all(name in found for name in intent.requires):
+                return intent, is_question
+        return None, is_question
+
+
+_matcher = IntentMatcher(INTENTS, conditions=[QUESTION_WORDS, INDIA])
+
+
+def get_response(text: str, emotion=Emotion.NEUTRAL) -> str:
+    """Emotion-aware fallback responder when Gemini isn't available.
+    `emotion` is an Emotion or EmotionResult (label strings are also accepted).
+    """
+    key = Emotion.of(emotion).value
+    intent, is_question = _matcher.match(text)
+
+    if intent is None:
+        if is_question:
+            return PREFIXES[key] + UNKNOWN_QUESTION
+        return DEFAULTS[key]
+
+    response = intent.response
+    if isinstance(response, dict):
+        response = response[key]
+    elif callable(response):
+        response = response()
+    return (PREFIXES[key] if intent.prefixed else "") + response
+
+
+def canned_responses():
+    """Every fixed reply get_response() can give (time and date answers excluded),
+    neutral ones first; used to pre-render speech"""
+    replies = []
+    for key in sorted(PREFIXES, key=lambda key: key != "neutral"):
+        prefix = PREFIXES[key]
+        for intent in INTENTS:
+            response = intent.response
+            if isinstance(response, dict):
+                response = response[key]
+            elif callable(response):
+                continue
+            replies.append((prefix if intent.prefixed else "") + response)
+        replies.append(prefix + UNKNOWN_QUESTION)
+        replies.append(DEFAULTS[key])
+    return list(dict.fromkeys(replies))
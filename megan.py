@@ -3,14 +3,35 @@
 MEGAN - Emotion-Aware Voice Assistant
 Main entry point that orchestrates all modules
 """
+import argparse
+import os
 import sys
+import time
 
-# Import modules
-from audio_handler import listen_and_recognize
+_STARTED = time.perf_counter()
+
+# Import modules (third-party libraries inside them are loaded lazily)
+import asr
+import lazy
+import tracing
+import audio_handler
+from audio_handler import (
+    listen_and_recognize, record_utterance, recognize, report_audio_level, voice_input_available
+)
 from emotion_detector import analyze_emotion_from_audio
-from gemini_client import GeminiClient
-from text_to_speech import speak, speak_goodbye, tts_available
-from local_responses import get_response as local_responder
+from emotion_model import Emotion, get_classifier
+from gemini_client import GeminiClient, ResponseCache
+from pipeline import TurnPipeline
+from text_to_speech import (
+    GOODBYE, SentenceSegmenter, cancel_speech, get_speech_cache, is_speaking, is_tts_available,
+    prewarm_speech_cache, speak, speak_goodbye, speak_stream, start_tts_worker
+)
+from local_responses import canned_responses, get_response as local_responder
+
+_IMPORTED = time.perf_counter()
+
+# Failed recognitions in a row before switching to typed input
+MAX_VOICE_FAILURES = 3
 
 
 def clean_text(text):
@@ -21,83 +42,258 @@ def clean_text(text):
     return text
 
 
-def main():
-    """Main conversation loop"""
-    # Initialize Gemini client
-    gemini_client = GeminiClient()
-    gemini_available = gemini_client.available
+def stream_sentences(chunks):
+    """Yield cleaned, complete sentences from streamed text chunks"""
+    segmenter = SentenceSegmenter()
+    for chunk in chunks:
+        for sentence in segmenter.feed(chunk):
+            sentence = clean_text(sentence)
+            if sentence:
+                yield sentence
+    for sentence in segmenter.flush():
+        sentence = clean_text(sentence)
+        if sentence:
+            yield sentence
+
+
+def respond_streaming(gemini_client, user_input, emotion, interrupted=None):
+    """Print and speak a Gemini reply sentence by sentence while it generates.
+    Stops early once `interrupted` is set. Returns the full cleaned reply,
+    or None if Gemini produced nothing.
+    """
+    sentences = []
+    
+    def echoed():
+        for sentence in stream_sentences(gemini_client.stream_message(user_input, emotion)):
+            if interrupted is not None and interrupted.is_set():
+                break
+            if not sentences:
+                print("\nMegan: ", end="", flush=True)
+            print(sentence, end=" ", flush=True)
+            sentences.append(sentence)
+            yield sentence
+        if sentences:
+            print("\n")
     
+    if is_tts_available():
+        speak_stream(echoed())
+    else:
+        for _ in echoed():
+            pass
+    
+    if not sentences:
+        return None
+    return " ".join(sentences)
+
+
+def report_prompt_size(gemini_client):
+    """Print how big the last Gemini request was"""
+    stats = gemini_client.history.last_stats
+    if stats is None:
+        return
+    approx = "~" if stats["estimated"] else ""
+    summary = f" + summary of {stats['summarized']}" if stats["summarized"] else ""
+    print(f"[Prompt: {approx}{stats['prompt_tokens']} tokens, {stats['turns']} recent turns{summary}]")
+
+
+def report_timings(turn):
+    """Print where the time went in a turn (only while tracing is enabled)"""
+    timings = tracing.turn_summary(turn)
+    if timings:
+        stages = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+        print(f"[Timing: {stages}]")
+
+
+def next_voice_turn(pipeline):
+    """Wait for the pipeline's next turn; returns (transcript, audio, emotion)"""
+    print("You: Listening...")
+    turn = pipeline.next_turn()
+    tracing.set_turn(turn.id)
+    report_audio_level(turn.recording)
+    user_input = turn.transcript()
+    if not user_input:
+        return None, None, None
+    print(f"\nYou said: {user_input}")
+    return user_input, turn.recording, turn.emotion()
+
+
+def main(startup_profile=False, asr_name=None):
+    """Main conversation loop"""
     print("\n" + "="*60)
     print("  MEGAN - Emotion-Aware Voice Assistant")
     print("="*60)
     print("\nI'm Megan! I can detect your emotions from your voice.")
     print("Say 'exit', 'quit', 'stop', or 'goodbye' to end the conversation.\n")
+    greeted = time.perf_counter()
+    
+    # While the greeting is read, load the audio stack, ASR and emotion models, probe the
+    # speech engine and spawn the TTS process in the background; the Gemini SDK loads on this thread
+    asr_engine = asr.select_engine(asr_name)
+    warmup = lazy.warm_up(
+        audio_handler.np,
+        audio_handler.sd,
+        audio_handler.sr,
+        (f"ASR model ({asr_engine.name})", asr_engine.load),
+        ("emotion model", get_classifier),
+        is_tts_available,
+        ("TTS worker start", start_tts_worker),
+    )
+    
+    # Per-stage timings go to MEGAN_TRACE (JSONL) and/or a Prometheus
+    # endpoint on MEGAN_METRICS_PORT; both are off by default
+    tracing.configure_from_env()
     
-    if not tts_available:
+    # Initialize Gemini client; repeated questions are answered from the response
+    # cache (kept on disk across restarts if MEGAN_RESPONSE_CACHE names a file)
+    response_cache = ResponseCache(path=os.getenv("MEGAN_RESPONSE_CACHE"))
+    gemini_client = GeminiClient(cache=response_cache)
+    
+    warmup.join()
+    if not is_tts_available():
         print("[WARNING] Text-to-speech not available. Responses will be text-only.\n")
+    else:
+        # Render the goodbye and the canned local replies in the background (kept on
+        # disk, so only the first run pays for it); they then play from memory
+        prewarm_speech_cache([GOODBYE] + canned_responses())
+    # Only fixed replies are worth caching; time and date answers never recur
+    canned = frozenset(canned_responses())
+    
+    # Keep the microphone armed in the background; recognition and emotion
+    # analysis of each utterance run in parallel. While Megan is speaking only
+    # speech louder than her echo starts an utterance; it cuts her off at once
+    # (barge-in) and becomes the next turn.
+    pipeline = None
+    if voice_input_available():
+        pipeline = TurnPipeline(
+            record=lambda on_speech: record_utterance(gate=is_speaking, asr_engine=asr_engine,
+                                                      on_speech=on_speech),
+            recognize=lambda recording: recognize(recording, engine=asr_engine),
+            analyze=analyze_emotion_from_audio,
+            on_barge_in=cancel_speech,
+        )
+        pipeline.start()
+    interrupted = pipeline.interrupted if pipeline is not None else None
+    
+    if startup_profile:
+        ready = time.perf_counter()
+        lazy.report(extra=[
+            ("megan modules", _IMPORTED - _STARTED, "MainThread"),
+            ("setup after greeting", ready - greeted, "MainThread"),
+        ])
+        print(f"  greeting shown after {(greeted - _STARTED) * 1000:.0f} ms, "
+              f"ready to listen after {(ready - _STARTED) * 1000:.0f} ms\n")
+    voice_failures = 0
     
     # Main loop
     while True:
         try:
             # Get user input
-            user_input, audio = listen_and_recognize()
+            emotion = None
+            if pipeline is not None and voice_failures < MAX_VOICE_FAILURES:
+                user_input, audio, emotion = next_voice_turn(pipeline)
+                voice_failures = 0 if user_input else voice_failures + 1
+            else:
+                if pipeline is not None:
+                    print("\nSwitching to text input...")
+                voice_failures = 0
+                tracing.new_turn()
+                user_input, audio = listen_and_recognize(use_voice=pipeline is None)
             if not user_input:
-                import time
                 time.sleep(0.5)  # Prevent rapid empty input loops
                 continue
             
             user_input = user_input.strip()
             if not user_input:
-                import time
                 time.sleep(0.5)  # Prevent rapid empty input loops
                 continue
             
-            # Check for exit commands BEFORE emotion analysis to avoid audio glitches
+            # Check for exit commands before responding
             lower_input = user_input.lower()
             if any(cmd in lower_input for cmd in ["exit", "quit", "stop", "goodbye", "bye"]):
-                print("\nMegan: Goodbye! Have a nice day.")
-                if tts_available:
+                print(f"\nMegan: {GOODBYE}")
+                if is_tts_available():
                     speak_goodbye()
                 break
             
-            # Analyze emotion from audio
-            emotion = "neutral"
+            # Analyze emotion from audio (already done in parallel for voice turns)
+            if emotion is None:
+                emotion = analyze_emotion_from_audio(audio) if audio is not None else Emotion.NEUTRAL
             if audio is not None:
-                emotion = analyze_emotion_from_audio(audio)
                 print(f"[Detected emotion: {emotion}]")
             
-            # Get response
-            response_text = None
-            
-            # Try Gemini first if available
-            if gemini_available:
-                response_text = gemini_client.send_message(user_input, emotion)
-                if response_text is None:
-                    # Gemini failed, disable for this session and use fallback
-                    gemini_available = False
+            if pipeline is not None:
+                pipeline.begin_response()
+            respond_span = tracing.span("respond")
+            try:
+                # Try Gemini first if available; its reply is printed and spoken while it streams.
+                # After repeated failures the client's circuit breaker skips Gemini for a
+                # cooldown period and then tries it again.
+                if gemini_client.available:
+                    respond_span.set("responder", "gemini")
+                    response_text = respond_streaming(gemini_client, user_input, emotion, interrupted)
+                    if response_text is not None:
+                        report_prompt_size(gemini_client)
+                        continue
+                    if interrupted is not None and interrupted.is_set():
+                        continue
                     print("[Gemini unavailable, using local responses]")
-                    response_text = local_responder(user_input, emotion)
-            else:
+                
                 # Use local responder
+                respond_span.set("responder", "local")
                 response_text = local_responder(user_input, emotion)
-            
-            # Clean and display response
-            response_text = clean_text(response_text)
-            print(f"\nMegan: {response_text}\n")
-            
-            # Speak response
-            if tts_available:
-                speak(response_text)
+                
+                # Clean and display response
+                response_text = clean_text(response_text)
+                print(f"\nMegan: {response_text}\n")
+                
+                # Speak response
+                if is_tts_available():
+                    speak(response_text, cache=response_text in canned)
+            finally:
+                if pipeline is not None:
+                    pipeline.end_response()
+                respond_span.end()
+                report_timings(tracing.current_turn())
         
         except KeyboardInterrupt:
             print("\n\nInterrupted by user.")
-            if tts_available:
+            if is_tts_available():
                 speak_goodbye()
             break
         except Exception as e:
             print(f"\nError in main loop: {e}")
             continue
+    
+    if pipeline is not None:
+        pipeline.stop()
+    
+    stats = response_cache.stats()
+    if stats["hits"] or stats["misses"]:
+        print(f"[Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['bypassed']} bypassed]")
+    response_cache.close()
+    speech = get_speech_cache().stats()
+    if speech["hits"] or speech["misses"]:
+        print(f"[Speech cache: {speech['hits']} hits, {speech['misses']} misses]")
+    tracing.shutdown()
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Headless mode: python megan.py batch <corpus_dir> [options]
+        from batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        # Multi-session server: python megan.py serve [options]
+        from server import main as serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+    
+    parser = argparse.ArgumentParser(description="MEGAN - Emotion-Aware Voice Assistant",
+                                     epilog="Run 'python megan.py batch --help' for headless batch mode and "
+                                            "'python megan.py serve --help' for the multi-session server.")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="report how long each module import and engine probe took at start-up")
+    parser.add_argument("--asr", choices=sorted(asr.ENGINES),
+                        help="speech recognition engine (default: MEGAN_ASR or google)")
+    args = parser.parse_args()
+    main(startup_profile=args.startup_profile, asr_name=args.asr)
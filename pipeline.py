@@ -0,0 +1,132 @@
+"""
+Pipeline Module
+Runs the stages of a conversation turn concurrently
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from emotion_model import EmotionResult
+
+
+class Turn:
+    """One captured utterance with its recognition and emotion results in flight"""
+
+    def __init__(self, recording, transcript, emotion, turn_id=0):
+        self.recording = recording
+        self.id = turn_id  # tracing turn id (0 while tracing is off)
+        self._transcript = transcript
+        self._emotion = emotion
+
+    def transcript(self):
+        """Wait for speech recognition; returns text or None"""
+        return self._transcript.result()
+
+    def emotion(self):
+        """Wait for emotion analysis; returns the EmotionResult"""
+        try:
+            return self._emotion.result()
+        except Exception as e:
+            return EmotionResult("unknown", error=e)
+
+
+class TurnPipeline:
+    """Capture → (speech recognition ∥ emotion analysis) → response.
+
+    A capture thread keeps the microphone armed, so the next utterance can be
+    recorded while the current reply is still being generated or spoken.
+    Each recording is handed to a thread pool where recognition and emotion
+    analysis run side by side, and the finished turns wait in a bounded
+    queue for the main loop. Speech that starts while a reply is in progress
+    counts as a barge-in: the reply is interrupted as soon as the speech is
+    detected, and the utterance being captured becomes the next turn.
+
+    `record(on_speech)` must capture one utterance and call `on_speech()`
+    when it starts.
+    """
+
+    def __init__(self, record, recognize, analyze, on_barge_in=None, max_workers=2, max_pending=2):
+        self._record = record
+        self._recognize = recognize
+        self._analyze = analyze
+        self._on_barge_in = on_barge_in
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="megan-turn")
+        self._turns = queue.Queue(maxsize=max_pending)
+        self._stopped = threading.Event()
+        self._responding = threading.Event()
+        self._thread = None
+        # Set when the reply in progress should be abandoned
+        self.interrupted = threading.Event()
+
+    def start(self):
+        """Start the capture thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._capture_loop, name="megan-capture", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop capturing and release the worker threads"""
+        self._stopped.set()
+        self.interrupted.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _capture_loop(self):
+        turn_id = None
+        while not self._stopped.is_set():
+            # A capture that ends without speech keeps its turn id for the next try
+            if turn_id is None:
+                turn_id = tracing.new_turn()
+            try:
+                recording = self._record(on_speech=self._speech_started)
+            except Exception as e:
+                print(f"\nRecognition error: {e}")
+                self._stopped.wait(1.0)
+                continue
+            if recording is None or self._stopped.is_set():
+                continue
+
+            # Still answering the previous turn although this utterance started
+            # before the reply did (so _speech_started didn't see it): interrupt now
+            if self._responding.is_set() and not self.interrupted.is_set():
+                self.barge_in()
+
+            turn = Turn(
+                recording,
+                self._executor.submit(tracing.in_turn(turn_id, self._recognize), recording),
+                self._executor.submit(tracing.in_turn(turn_id, self._analyze), recording),
+                turn_id,
+            )
+            turn_id = None
+            while not self._stopped.is_set():
+                try:
+                    self._turns.put(turn, timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+
+    def _speech_started(self):
+        if self._responding.is_set():
+            self.barge_in()
+
+    def next_turn(self, timeout=None):
+        """Return the next captured turn, or None if none arrived within `timeout`"""
+        try:
+            return self._turns.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def begin_response(self):
+        """Mark the start of a reply that a new utterance may interrupt"""
+        self.interrupted.clear()
+        self._responding.set()
+
+    def end_response(self):
+        """Mark the reply as finished"""
+        self._responding.clear()
+
+    def barge_in(self):
+        """Abandon the reply in progress"""
+        self.interrupted.set()
+        if self._on_barge_in is not None:
+            self._on_barge_in()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Server Module
+Multi-session MEGAN over HTTP or WebSocket: many clients share one ASR engine, TTS pool and response cache
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import asr
+import lazy
+import tracing
+import wav_decoder
+from audio_handler import BLOCK_MS, HANGOVER_S, MAX_UTTERANCE_S, MIN_SPEECH_MS, PRE_ROLL_S, SAMPLE_RATE, EnergyVAD
+from emotion_detector import analyze_emotion_from_audio
+from emotion_model import Emotion, EmotionResult
+from gemini_client import GeminiClient, ResponseCache
+from local_responses import canned_responses, get_response as local_responder
+from text_to_speech import TTS_POOL_SIZE, TTSPool, is_tts_available, prewarm_speech_cache, render_speech
+
+np = lazy.lazy_import("numpy")
+websockets = lazy.lazy_import("websockets")
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_SESSIONS = 1000
+SESSION_IDLE_S = 600  # HTTP sessions without a request for this long are closed
+WORKERS = 32  # threads for ASR, emotion analysis and waiting on TTS renders
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_QUEUED_TURNS = 4  # per WebSocket session; further audio waits (backpressure)
+
+
+class SessionLimit(Exception):
+    pass
+
+
+class UtteranceSegmenter:
+    """Cuts streamed int16 PCM into utterances with the same energy VAD as local capture"""
+
+    def __init__(self, fs=SAMPLE_RATE):
+        self.fs = fs
+        self.blocksize = max(1, int(fs * BLOCK_MS / 1000))
+        min_speech_blocks = max(1, round(MIN_SPEECH_MS / BLOCK_MS))
+        self.vad = EnergyVAD(
+            min_speech_blocks=min_speech_blocks,
+            hangover_blocks=max(1, round(HANGOVER_S * 1000 / BLOCK_MS)),
+        )
+        self.max_blocks = int(MAX_UTTERANCE_S * 1000 / BLOCK_MS)
+        # Blocks kept from before speech onset (pre-roll plus the onset blocks themselves)
+        self._recent = deque(maxlen=round(PRE_ROLL_S * 1000 / BLOCK_MS) + min_speech_blocks)
+        self._pending = b""
+        self._speech = None
+
+    def feed(self, data):
+        """Add little-endian int16 PCM bytes; returns the utterances they completed"""
+        data = self._pending + data
+        n_blocks = len(data) // (2 * self.blocksize)
+        used = n_blocks * 2 * self.blocksize
+        self._pending = data[used:]
+        blocks = np.frombuffer(data[:used], dtype='<i2').reshape(n_blocks, self.blocksize)
+
+        utterances = []
+        for block in blocks:
+            event = self.vad.update(block, 0)
+            if self._speech is None:
+                self._recent.append(block)
+                if event == "start":
+                    self._speech = list(self._recent)
+                    self._recent.clear()
+                continue
+            self._speech.append(block)
+            if event == "end" or len(self._speech) >= self.max_blocks:
+                utterances.append(self._finish())
+        return utterances
+
+    def flush(self):
+        """End of stream: return the utterance in progress, if any"""
+        return [self._finish()] if self._speech else []
+
+    def _finish(self):
+        samples = np.concatenate(self._speech)
+        self._speech = None
+        self.vad.reset()
+        return samples
+
+
+class Session:
+    """One client: its own conversation history, emotion context and audio segmenter"""
+
+    def __init__(self, session_id, gemini=None, fs=SAMPLE_RATE):
+        self.id = session_id
+        self.gemini = gemini.new_session() if gemini is not None else None
+        self.segmenter = UtteranceSegmenter(fs)
+        self.emotion = EmotionResult("neutral")
+        self.turns = 0
+        self.last_seen = time.monotonic()
+
+
+def _json_request(data):
+    """Parse a JSON request; anything but an object with a string "text" raises ValueError"""
+    request = json.loads(data or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("request must be a JSON object")
+    if not isinstance(request.get("text", ""), str):
+        raise ValueError('"text" must be a string')
+    return request
+
+
+def _clean_text(text):
+    # Imported here: megan pulls in the whole interactive stack
+    from megan import clean_text
+    return clean_text(text)
+
+
+class MeganServer:
+    """Session registry plus the turn logic shared by both transports.
+
+    The ASR engine, emotion classifier, TTS render pool and response cache
+    are process-wide; blocking stages run on a bounded thread pool so the
+    event loop only shuffles bytes.
+    """
+
+    def __init__(self, asr_engine=None, responder="gemini", tts=True, max_sessions=MAX_SESSIONS,
+                 workers=WORKERS, tts_workers=TTS_POOL_SIZE):
+        self.asr_engine = asr_engine
+        self.cache = ResponseCache(path=os.getenv("MEGAN_RESPONSE_CACHE"))
+        self.gemini = GeminiClient(cache=self.cache) if responder == "gemini" else None
+        self.tts = tts and is_tts_available()
+        self.tts_pool = TTSPool(tts_workers) if self.tts else None
+        self._canned = frozenset(canned_responses())
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="megan-server")
+        self._turns = itertools.count(1)
+
+    def _render(self, reply):
+        # Only fixed local replies go into the speech cache
+        return render_speech(reply, renderer=self.tts_pool, cache=reply in self._canned)
+
+    def open_session(self, fs=SAMPLE_RATE):
+        if len(self.sessions) >= self.max_sessions:
+            raise SessionLimit(f"server is at its limit of {self.max_sessions} sessions")
+        session = Session(uuid.uuid4().hex, self.gemini, fs)
+        self.sessions[session.id] = session
+        return session
+
+    def close_session(self, session_id):
+        return self.sessions.pop(session_id, None) is not None
+
+    def expire_sessions(self, idle=SESSION_IDLE_S):
+        cutoff = time.monotonic() - idle
+        for session_id in [s.id for s in self.sessions.values() if s.last_seen < cutoff]:
+            self.close_session(session_id)
+
+    async def _stage(self, timings, name, turn_id, fn, *args):
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, tracing.in_turn(turn_id, fn), *args)
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    async def turn(self, session, samples=None, framerate=SAMPLE_RATE, text=None, transcript=None,
+                   audio_reply=True):
+        """Run one turn; returns (result dict, reply audio bytes or None).
+
+        Audio turns recognise `samples` (unless a reference `transcript` is
+        given) while the emotion is analysed in parallel; text turns reuse the
+        session's last detected emotion.
+        """
+        session.last_seen = time.monotonic()
+        session.turns += 1
+        turn_id = tracing.new_turn()
+        timings = {}
+        start = time.perf_counter()
+
+        emotion = session.emotion
+        if samples is not None:
+            analysis = asyncio.ensure_future(
+                self._stage(timings, "emotion", turn_id, analyze_emotion_from_audio, samples, framerate))
+            if transcript is not None:
+                text = transcript
+            elif self.asr_engine is not None:
+                text = await self._stage(timings, "asr", turn_id, self.asr_engine.recognize, samples, framerate)
+            emotion = session.emotion = await analysis
+
+        result = {
+            "session": session.id,
+            "turn": session.turns,
+            "transcript": text,
+            "emotion": emotion.label,
+            "emotion_confidence": round(emotion.confidence, 3),
+            "reply": None,
+            "responder": None,
+        }
+        audio = None
+        if text and text.strip():
+            respond_start = time.perf_counter()
+            reply = None
+            if session.gemini is not None and session.gemini.available:
+                # Only fresh measurements count towards the session's emotion trajectory
+                measured = emotion if samples is not None else Emotion.of(emotion)
+                reply = await session.gemini.send_message_async(text, measured)
+                result["responder"] = "gemini"
+            if reply is None:
+                reply = local_responder(text, Emotion.of(emotion))
+                result["responder"] = "local"
+            result["reply"] = _clean_text(reply)
+            timings["respond"] = time.perf_counter() - respond_start
+
+            if self.tts and audio_reply:
+                audio = await self._stage(timings, "tts", turn_id, self._render, result["reply"])
+
+        timings["total"] = time.perf_counter() - start
+        result["timings_ms"] = {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+        return result, audio
+
+    # HTTP transport
+
+    async def handle_http(self, reader, writer):
+        """One HTTP/1.1 connection (keep-alive): JSON in, JSON out"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, payload = await self._route(method, target, headers, body)
+                    except (ValueError, KeyError) as e:
+                        status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+                    keep_alive = headers.get("connection", "").lower() != "close"
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, target, headers, body):
+        url = urlsplit(target)
+        parts = [p for p in url.path.split("/") if p]
+        query = parse_qs(url.query)
+
+        if method == "GET" and parts == ["health"]:
+            return HTTPStatus.OK, {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "asr": self.asr_engine.name if self.asr_engine else None,
+                "gemini": self.gemini is not None and self.gemini.available,
+                "tts": self.tts,
+            }
+        if method == "POST" and parts == ["sessions"]:
+            try:
+                session = self.open_session()
+            except SessionLimit as e:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}
+            return HTTPStatus.CREATED, {"session": session.id}
+        if len(parts) >= 2 and parts[0] == "sessions":
+            session = self.sessions.get(parts[1])
+            if session is None:
+                return HTTPStatus.NOT_FOUND, {"error": "unknown session"}
+            if method == "DELETE" and len(parts) == 2:
+                self.close_session(session.id)
+                return HTTPStatus.OK, {"closed": session.id}
+            if method == "POST" and parts[2:] == ["turn"]:
+                return HTTPStatus.OK, await self._http_turn(session, headers, body, query)
+        return HTTPStatus.NOT_FOUND, {"error": f"no route for {method} {url.path}"}
+
+    async def _http_turn(self, session, headers, body, query):
+        audio_reply = query.get("audio", ["1"])[0] not in ("0", "false", "no")
+        if headers.get("content-type", "").startswith("application/json"):
+            text = _json_request(body).get("text", "")
+            result, audio = await self.turn(session, text=text, audio_reply=audio_reply)
+        else:
+            # WAV body; X-Transcript carries a reference transcript (load tests, --asr none)
+            wav = wav_decoder.decode(body)
+            result, audio = await self.turn(session, samples=wav.to_int16(), framerate=wav.framerate,
+                                            transcript=headers.get("x-transcript"), audio_reply=audio_reply)
+        result["audio_wav"] = base64.b64encode(audio).decode("ascii") if audio else None
+        return result
+
+    # WebSocket transport
+
+    async def handle_websocket(self, websocket, path=None):
+        """One streaming client.
+
+        Binary messages are int16 mono PCM (16 kHz unless a
+        {"type": "config", "sample_rate": ...} message says otherwise);
+        utterances are cut out by the VAD as they end. {"type": "text"}
+        sends a typed turn and {"type": "end"} flushes a trailing utterance.
+        Each turn is answered with a JSON "reply" message, followed by the
+        synthesized WAV as a binary message when there is one; a malformed
+        message gets an {"type": "error"} message and the session goes on.
+        """
+        try:
+            session = self.open_session()
+        except SessionLimit as e:
+            await websocket.close(1013, str(e))
+            return
+        await websocket.send(json.dumps({"type": "session", "session": session.id}))
+
+        turns = asyncio.Queue(maxsize=MAX_QUEUED_TURNS)
+        replies = asyncio.ensure_future(self._websocket_replies(websocket, session, turns))
+        try:
+            async for message in websocket:
+                session.last_seen = time.monotonic()
+                if isinstance(message, bytes):
+                    for utterance in session.segmenter.feed(message):
+                        await turns.put(("audio", utterance))
+                    continue
+                try:
+                    request = _json_request(message)
+                    kind = request.get("type")
+                    if kind == "config":
+                        sample_rate = int(request.get("sample_rate", SAMPLE_RATE))
+                        if sample_rate <= 0:
+                            raise ValueError("sample_rate must be positive")
+                        session.segmenter = UtteranceSegmenter(sample_rate)
+                except (ValueError, TypeError) as e:
+                    await websocket.send(json.dumps({"type": "error", "error": str(e)}))
+                    continue
+                if kind == "text":
+                    await turns.put(("text", request.get("text", "")))
+                elif kind == "end":
+                    for utterance in session.segmenter.flush():
+                        await turns.put(("audio", utterance))
+        except Exception as e:
+            if not isinstance(e, websockets.ConnectionClosed):
+                print(f"[WARNING] Session {session.id[:8]}: {e}")
+        finally:
+            try:
+                await turns.put(None)
+                await replies
+            finally:
+                self.close_session(session.id)
+
+    async def _websocket_replies(self, websocket, session, turns):
+        # Runs until the reader's None, draining the queue even after the client
+        # has gone so the reader never blocks on a full queue
+        closed = False
+        while True:
+            item = await turns.get()
+            if item is None:
+                return
+            if closed:
+                continue
+            kind, value = item
+            try:
+                if kind == "audio":
+                    result, audio = await self.turn(session, samples=value, framerate=session.segmenter.fs)
+                else:
+                    result, audio = await self.turn(session, text=value)
+                await websocket.send(json.dumps(dict(result, type="reply")))
+                if audio:
+                    await websocket.send(audio)
+            except Exception as e:
+                if isinstance(e, websockets.ConnectionClosed):
+                    closed = True
+                    continue
+                print(f"[WARNING] Session {session.id[:8]} turn failed: {e}")
+
+
+async def _expire_sessions(server, interval=60):
+    while True:
+        await asyncio.sleep(interval)
+        server.expire_sessions()
+
+
+async def serve(server, host=DEFAULT_HOST, port=DEFAULT_PORT, transport="http", ready=None):
+    """Run `server` until cancelled"""
+    if transport == "websocket":
+        if not lazy.available(websockets):
+            raise RuntimeError("the websockets package is required for --transport websocket")
+        listener = await websockets.serve(server.handle_websocket, host, port, max_size=MAX_BODY_BYTES)
+        port = listener.sockets[0].getsockname()[1]
+        scheme = "ws"
+    else:
+        listener = await asyncio.start_server(server.handle_http, host, port, limit=MAX_BODY_BYTES,
+                                              backlog=1024)
+        port = listener.sockets[0].getsockname()[1]
+        scheme = "http"
+    print(f"[Serving on {scheme}://{host}:{port}]", flush=True)
+    if ready is not None:
+        ready.set_result(port)
+
+    reaper = asyncio.ensure_future(_expire_sessions(server))
+    try:
+        await asyncio.Future()  # run until cancelled
+    finally:
+        reaper.cancel()
+        listener.close()
+        await listener.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="megan.py serve",
+        description="Serve MEGAN to many concurrent clients over HTTP or WebSocket."
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--transport", choices=["http", "websocket"], default="http",
+                        help="'websocket' streams PCM in and replies out (needs the websockets package)")
+    parser.add_argument("--asr", choices=sorted(asr.ENGINES) + ["none"],
+                        help="speech recognition engine (default: MEGAN_ASR or google); "
+                             "'none' only uses transcripts sent by the client")
+    parser.add_argument("--responder", choices=["gemini", "local"], default="gemini")
+    parser.add_argument("--no-tts", action="store_true", help="reply with text only")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads for ASR, emotion and TTS")
+    parser.add_argument("--tts-workers", type=int, default=TTS_POOL_SIZE, help="TTS render processes")
+    args = parser.parse_args(argv)
+
+    tracing.configure_from_env()
+    asr_engine = None
+    if args.asr != "none":
+        asr_engine = asr.select_engine(args.asr)
+        asr_engine.load()
+    server = MeganServer(asr_engine=asr_engine, responder=args.responder, tts=not args.no_tts,
+                         max_sessions=args.max_sessions, workers=args.workers, tts_workers=args.tts_workers)
+    if server.tts_pool is not None:
+        server.tts_pool.start()
+        prewarm_speech_cache(canned_responses(), renderer=server.tts_pool)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.transport))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False, cancel_futures=True)
+        if server.tts_pool is not None:
+            server.tts_pool.shutdown()
+        server.cache.close()
+        tracing.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
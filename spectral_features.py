@@ -0,0 +1,397 @@
+"""
+Spectral Features Module
+Vectorized STFT, mel filterbank, MFCC, autocorrelation pitch, spectral centroid and flux
+"""
+from functools import lru_cache
+
+import lazy
+
+np = lazy.lazy_import("numpy")
+# scipy.fft is faster for batched transforms; numpy.fft is the fallback
+scipy_fft = lazy.lazy_import("scipy.fft")
+scipy_signal = lazy.lazy_import("scipy.signal")
+
+
+# Analysis frame (same 25 ms / 10 ms grid as emotion_detector)
+FRAME_MS = 25
+HOP_MS = 10
+N_MELS = 40
+N_MFCC = 13
+FMIN = 50.0
+# Pitch search range (Hz; a 25 ms frame holds two periods down to 80 Hz), the
+# normalised autocorrelation peak that counts as voiced, and the lowest sample
+# rate the pitch search runs at (the spectrum is band-limited before the inverse FFT)
+PITCH_MIN = 80.0
+PITCH_MAX = 400.0
+VOICING_THRESHOLD = 0.45
+PITCH_RATE = 8000
+# Shorter-lag peaks within this fraction of the highest one win (avoids octave errors)
+OCTAVE_TOLERANCE = 0.9
+
+# Frames transformed per block in extract_spectral_features
+CHUNK_FRAMES = 128
+
+# Layout of SpectralFeatures.vector()
+SUMMARY_NAMES = (
+    tuple(f"mfcc{i}_mean" for i in range(N_MFCC))
+    + tuple(f"mfcc{i}_std" for i in range(N_MFCC))
+    + ("pitch_mean", "pitch_std", "pitch_range", "voiced_fraction",
+       "centroid_mean", "centroid_std", "flux_mean", "flux_std")
+)
+
+
+def _fft():
+    return scipy_fft if lazy.available(scipy_fft) else np.fft
+
+
+def _frozen(array):
+    # Cached arrays are shared between callers; make accidental writes fail loudly
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=None)
+def frame_sizes(fs, frame_ms=FRAME_MS, hop_ms=HOP_MS):
+    """(frame_length, hop_length, n_fft) in samples for a sample rate.
+
+    n_fft covers the frame plus the longest pitch period, so the same spectrum
+    gives a linear (non-circular) autocorrelation over every lag searched.
+    """
+    frame_length = max(2, int(fs * frame_ms / 1000))
+    hop_length = max(1, int(fs * hop_ms / 1000))
+    n_fft = 1 << (frame_length + int(fs / PITCH_MIN) + 1).bit_length()
+    return frame_length, hop_length, n_fft
+
+
+@lru_cache(maxsize=None)
+def window(frame_length):
+    """Periodic Hann window"""
+    if lazy.available(scipy_signal):
+        w = scipy_signal.get_window("hann", frame_length, fftbins=True)
+    else:
+        w = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame_length) / frame_length)
+    return _frozen(w.astype('float32'))
+
+
+def _hz_to_mel(hz):
+    return 2595.0 * np.log10(1.0 + np.asarray(hz) / 700.0)
+
+
+def _mel_to_hz(mel):
+    return 700.0 * (10.0 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+
+@lru_cache(maxsize=None)
+def mel_filterbank(fs, n_fft, n_mels=N_MELS, fmin=FMIN, fmax=None):
+    """Triangular (HTK) mel filters shaped (n_mels, n_fft // 2 + 1)"""
+    fmax = fs / 2 if fmax is None else fmax
+    bins = np.fft.rfftfreq(n_fft, 1.0 / fs)
+    edges = _mel_to_hz(np.linspace(_hz_to_mel(fmin), _hz_to_mel(fmax), n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    filters = np.maximum(0.0, np.minimum(rising, falling))
+    # Equal area per filter, so wide high-frequency bands don't dominate
+    filters *= (2.0 / (upper - lower))
+    return _frozen(filters.astype('float32'))
+
+
+@lru_cache(maxsize=None)
+def dct_matrix(n_mfcc=N_MFCC, n_mels=N_MELS):
+    """Orthonormal DCT-II basis (same as scipy.fft.dct(type=2, norm="ortho")) as a matrix"""
+    k = np.arange(n_mfcc)[:, None]
+    n = np.arange(n_mels)[None, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2.0 / n_mels)
+    basis[0] /= np.sqrt(2.0)
+    return _frozen(basis.astype('float32'))
+
+
+def frames(x, frame_length, hop_length):
+    """Strided (n_frames, frame_length) view; short signals are zero-padded to one frame"""
+    if len(x) < frame_length:
+        x = np.pad(x, (0, frame_length - len(x)))
+    return np.lib.stride_tricks.sliding_window_view(x, frame_length)[::hop_length]
+
+
+class SpectralFeatures:
+    """Per-frame spectral features of one utterance.
+
+    `mfcc` is (n_frames, N_MFCC); `pitch` holds Hz per frame (0 where
+    unvoiced); `centroid` is Hz; `flux` is the rectified change of the
+    normalised magnitude spectrum from the previous frame.
+    """
+
+    def __init__(self, mfcc, log_mel, pitch, centroid, flux, framerate, hop_length):
+        self.mfcc = mfcc
+        self.log_mel = log_mel
+        self.pitch = pitch
+        self.centroid = centroid
+        self.flux = flux
+        self.framerate = framerate
+        self.hop_length = hop_length
+
+    def vector(self):
+        """Utterance-level summary as a float32 vector laid out as SUMMARY_NAMES"""
+        voiced = self.pitch[self.pitch > 0]
+        if len(voiced):
+            pitch_stats = [voiced.mean(), voiced.std(), voiced.max() - voiced.min()]
+        else:
+            pitch_stats = [0.0, 0.0, 0.0]
+        return np.concatenate((
+            self.mfcc.mean(axis=0),
+            self.mfcc.std(axis=0),
+            pitch_stats,
+            [len(voiced) / max(1, len(self.pitch)),
+             self.centroid.mean(), self.centroid.std(),
+             self.flux.mean(), self.flux.std()],
+        )).astype('float32')
+
+    def summary(self):
+        """Utterance-level summary as {name: value}"""
+        return dict(zip(SUMMARY_NAMES, self.vector().tolist()))
+
+
+@lru_cache(maxsize=None)
+def pitch_decimation(fs):
+    """Power-of-two factor that brings `fs` down towards PITCH_RATE"""
+    factor = 1
+    while fs / (factor * 2) >= PITCH_RATE:
+        factor *= 2
+    return factor
+
+
+@lru_cache(maxsize=None)
+def window_autocorrelation(frame_length, n_fft, decimation):
+    """Autocorrelation of the analysis window, used to undo its taper"""
+    spectrum = np.fft.rfft(window(frame_length), n=n_fft)
+    n = n_fft // decimation
+    ac = np.fft.irfft(np.abs(spectrum[:n // 2 + 1]) ** 2, n=n)
+    return _frozen((ac / ac[0]).astype('float32'))
+
+
+def pitch_from_power(power, fs, frame_length, n_fft, fmin=PITCH_MIN, fmax=PITCH_MAX,
+                     threshold=VOICING_THRESHOLD):
+    """Per-frame f0 from the autocorrelation (inverse FFT of the power spectrum).
+
+    Only the low band of the spectrum is transformed back, which is the
+    autocorrelation of the signal decimated towards PITCH_RATE. Dividing by the
+    window's own autocorrelation removes the bias towards short lags, and the
+    peak is refined by parabolic interpolation. A frame is voiced when that
+    peak reaches `threshold` of the zero-lag energy; unvoiced frames get 0.
+    """
+    decimation = pitch_decimation(fs)
+    rate = fs / decimation
+    n = n_fft // decimation
+    min_lag = max(1, int(rate / fmax))
+    max_lag = min(frame_length // decimation - 2, int(rate / fmin) + 1)
+    if max_lag <= min_lag + 1:
+        return np.zeros(len(power), dtype='float32')
+
+    ac = _fft().irfft(power[:, :n // 2 + 1], n=n, axis=1)
+    normalized = ac[:, :max_lag + 2] / window_autocorrelation(frame_length, n_fft, decimation)[:max_lag + 2]
+    search = normalized[:, min_lag - 1:max_lag + 2]
+    rows = np.arange(len(search))
+    # Take the shortest-lag local maximum close to the best one: a periodic
+    # signal peaks at every multiple of its period, and the first is f0
+    middle = search[:, 1:-1]
+    best = middle.max(axis=1, keepdims=True)
+    candidates = (middle >= search[:, :-2]) & (middle >= search[:, 2:]) & (middle >= OCTAVE_TOLERANCE * best)
+    lag = np.where(candidates.any(axis=1), np.argmax(candidates, axis=1), np.argmax(middle, axis=1)) + min_lag
+    peak = normalized[rows, lag]
+
+    before, after = normalized[rows, lag - 1], normalized[rows, lag + 1]
+    curvature = before - 2 * peak + after
+    offset = np.where(curvature < 0, 0.5 * (before - after) / np.where(curvature < 0, curvature, -1), 0.0)
+
+    voiced = peak > threshold * np.maximum(normalized[:, 0], 1e-12)
+    return np.where(voiced, rate / (lag + offset), 0.0).astype('float32')
+
+
+def _frame_features(blocks, n_frames, framerate, frame_length, n_fft, previous=None):
+    """Per-frame log-mel, pitch, centroid and flux over consecutive blocks of frames.
+
+    `previous` is the normalised magnitude spectrum (1, n_fft // 2 + 1) of the
+    frame before the first one, for streams analysed piece by piece; the
+    last frame's is returned alongside the features.
+    """
+    win = window(frame_length)
+    filterbank_t = mel_filterbank(framerate, n_fft).T
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / framerate).astype('float32')
+
+    log_mel = np.empty((n_frames, N_MELS), dtype='float32')
+    pitch = np.empty(n_frames, dtype='float32')
+    centroid = np.empty(n_frames, dtype='float32')
+    flux = np.empty(n_frames, dtype='float32')
+
+    start = 0
+    for block in blocks:
+        stop = start + len(block)
+        spectrum = _fft().rfft(block * win, n=n_fft, axis=1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).astype('float32')
+        magnitude = np.sqrt(power)
+
+        log_mel[start:stop] = np.log(power @ filterbank_t + 1e-10)
+
+        total = np.maximum(magnitude.sum(axis=1), 1e-10)
+        centroid[start:stop] = (magnitude @ freqs) / total
+
+        normalized = magnitude / total[:, None]
+        change = np.diff(normalized, axis=0, prepend=normalized[:1] if previous is None else previous)
+        flux[start:stop] = np.sqrt(np.sum(np.maximum(change, 0.0) ** 2, axis=1))
+        previous = normalized[-1:]
+
+        pitch[start:stop] = pitch_from_power(power, framerate, frame_length, n_fft)
+        start = stop
+
+    return log_mel, pitch, centroid, flux, previous
+
+
+def as_float32(audio_array):
+    """1-D float32 samples; integer input is int16 PCM and is scaled to [-1, 1)"""
+    x = np.asarray(audio_array).reshape(-1)
+    if x.dtype.kind in "iu":
+        return x.astype('float32') / 32768.0
+    return x.astype('float32', copy=False)
+
+
+def extract_spectral_features(audio_array, framerate=16000):
+    """Compute SpectralFeatures for int16 or float samples in one vectorized pass"""
+    frame_length, hop_length, n_fft = frame_sizes(framerate)
+    framed = frames(as_float32(audio_array), frame_length, hop_length)
+    # Blocks of frames keep the complex spectrum cache-sized on long recordings
+    blocks = (framed[start:start + CHUNK_FRAMES] for start in range(0, len(framed), CHUNK_FRAMES))
+    log_mel, pitch, centroid, flux, _ = _frame_features(blocks, len(framed), framerate, frame_length, n_fft)
+    mfcc = log_mel @ dct_matrix().T
+    return SpectralFeatures(mfcc, log_mel, pitch, centroid, flux, framerate, hop_length)
+
+
+def _frame_blocks(clip_frames):
+    """Regroup the frames of many clips into blocks of CHUNK_FRAMES rows"""
+    pending, size = [], 0
+    for framed in clip_frames:
+        start = 0
+        while start < len(framed):
+            piece = framed[start:start + CHUNK_FRAMES - size]
+            pending.append(piece)
+            size += len(piece)
+            start += len(piece)
+            if size == CHUNK_FRAMES:
+                yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+                pending, size = [], 0
+    if pending:
+        yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+
+def extract_spectral_features_batch(clips, framerate=16000):
+    """SpectralFeatures for many clips (same sample rate), transformed together.
+
+    The frames of all clips go through the STFT in shared blocks, so short
+    clips don't each pay the per-call overhead. Results match
+    extract_spectral_features() clip by clip.
+    """
+    frame_length, hop_length, n_fft = frame_sizes(framerate)
+    clip_frames = [frames(as_float32(clip), frame_length, hop_length) for clip in clips]
+    counts = [len(framed) for framed in clip_frames]
+    log_mel, pitch, centroid, flux, _ = _frame_features(
+        _frame_blocks(clip_frames), sum(counts), framerate, frame_length, n_fft)
+    mfcc = log_mel @ dct_matrix().T
+
+    bounds = np.cumsum(counts)[:-1]
+    # Flux has no previous frame at the start of each clip
+    flux[bounds] = 0.0
+    return [SpectralFeatures(*parts, framerate, hop_length) for parts in zip(
+        np.split(mfcc, bounds), np.split(log_mel, bounds), np.split(pitch, bounds),
+        np.split(centroid, bounds), np.split(flux, bounds))]
+
+
+class RunningMoments:
+    """Count, mean and spread of a stream of values (scalars or fixed-width rows).
+
+    Each update() folds in a whole batch with Chan et al.'s parallel form of
+    Welford's algorithm, so only the running totals are kept.
+    """
+
+    def __init__(self, width=None):
+        shape = () if width is None else (width,)
+        self.n = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)  # sum of squared deviations from the mean
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        k = len(values)
+        if not k:
+            return
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+        n = self.n + k
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (k / n)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.n * k / n)
+        self.n = n
+
+    @property
+    def std(self):
+        """Population standard deviation (like np.std)"""
+        return np.sqrt(self.m2 / self.n) if self.n else np.zeros_like(self.mean)
+
+
+class SpectralStream:
+    """SpectralFeatures.vector() of a signal that arrives in pieces.
+
+    Complete frames are analysed as soon as their samples are in and folded
+    into running moments; only the samples of the frame in progress are
+    kept. vector() matches extract_spectral_features() on the whole signal.
+    """
+
+    def __init__(self, framerate=16000):
+        self.framerate = framerate
+        self.frame_length, self.hop_length, self.n_fft = frame_sizes(framerate)
+        self.n_frames = 0
+        self._tail = np.zeros(0, dtype='float32')  # samples from the next frame's start on
+        self._previous = None
+        self._mfcc = RunningMoments(N_MFCC)
+        self._pitch = RunningMoments()
+        self._pitch_min = np.inf
+        self._pitch_max = -np.inf
+        self._centroid = RunningMoments()
+        self._flux = RunningMoments()
+
+    def feed(self, samples):
+        """Add int16 or float samples"""
+        self._tail = np.concatenate((self._tail, as_float32(samples)))
+        if len(self._tail) >= self.frame_length:
+            n_frames = (len(self._tail) - self.frame_length) // self.hop_length + 1
+            self._add(frames(self._tail, self.frame_length, self.hop_length)[:n_frames])
+            self._tail = self._tail[n_frames * self.hop_length:]
+
+    def _add(self, framed):
+        log_mel, pitch, centroid, flux, self._previous = _frame_features(
+            [framed], len(framed), self.framerate, self.frame_length, self.n_fft, self._previous)
+        self.n_frames += len(framed)
+        self._mfcc.update(log_mel @ dct_matrix().T)
+        voiced = pitch[pitch > 0]
+        if len(voiced):
+            self._pitch.update(voiced)
+            self._pitch_min = min(self._pitch_min, float(voiced.min()))
+            self._pitch_max = max(self._pitch_max, float(voiced.max()))
+        self._centroid.update(centroid)
+        self._flux.update(flux)
+
+    def vector(self):
+        """Summary laid out as SUMMARY_NAMES (a signal shorter than one frame is zero-padded to one)"""
+        if self.n_frames == 0 and len(self._tail):
+            self._add(frames(self._tail, self.frame_length, self.hop_length))
+            self._tail = self._tail[:0]
+        if self._pitch.n:
+            pitch_stats = [self._pitch.mean, self._pitch.std, self._pitch_max - self._pitch_min]
+        else:
+            pitch_stats = [0.0, 0.0, 0.0]
+        return np.concatenate((
+            self._mfcc.mean,
+            self._mfcc.std,
+            pitch_stats,
+            [self._pitch.n / max(1, self.n_frames),
+             self._centroid.mean, self._centroid.std,
+             self._flux.mean, self._flux.std],
+        )).astype('float32')
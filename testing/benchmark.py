@@ -0,0 +1,279 @@
+"""Benchmark suite for every pipeline stage, on deterministic synthetic audio.
+
+Times emotion analysis, WAV decoding, local responses, text cleaning and the
+Gemini/TTS code paths (against in-process stubs, no network or audio device).
+Results are compared with a stored baseline and regressions are flagged.
+
+    python testing/benchmark.py            # run and compare with the baseline
+    python testing/benchmark.py --save     # run and store a new baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DURATIONS = (1, 3, 10)  # seconds
+SAMPLE_RATES = (8000, 16000, 44100)
+
+
+def synth_speech(duration, fs, seed=0, level=0.3):
+    """Deterministic speech-like int16 signal.
+
+    A glottal-style harmonic source with a wandering pitch, shaped by three
+    formant resonances, gated into 3-5 Hz syllables with short pauses, plus
+    a little breath noise.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * fs)
+    t = np.arange(n) / fs
+
+    # Pitch contour: 110-220 Hz with slow drift and vibrato
+    f0 = 150 + 40 * np.sin(2 * np.pi * 0.3 * t + rng.uniform(0, np.pi)) + 5 * np.sin(2 * np.pi * 5.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / fs
+
+    # Harmonics up to Nyquist (max 4 kHz), weighted by formant peaks
+    formants = np.array([500, 1500, 2500]) * rng.uniform(0.9, 1.1, 3)
+    bandwidths = np.array([80, 120, 160])
+    signal = np.zeros(n)
+    for k in range(1, int(min(4000, fs / 2) // 110)):
+        freq = k * 150
+        gain = np.sum(1 / (1 + ((freq - formants) / bandwidths) ** 2)) / k ** 0.5
+        signal += gain * np.sin(k * phase)
+
+    # Syllable envelope with pauses
+    rate = rng.uniform(3, 5)
+    envelope = np.clip(np.sin(np.pi * rate * t) ** 2 * 1.4 - 0.2, 0, 1)
+    signal = signal * envelope + 0.02 * rng.standard_normal(n)
+
+    signal *= level / (np.max(np.abs(signal)) or 1)
+    return (signal * 32767).astype('int16')
+
+
+def wav_bytes(samples, fs):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(fs)
+        wf.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+class StubAudioData:
+    """Stands in for speech_recognition.AudioData"""
+
+    def __init__(self, data):
+        self._data = data
+
+    def get_wav_data(self):
+        return self._data
+
+
+class StubResponse:
+    def __init__(self, text, chunks=None):
+        self.text = text
+        self._chunks = chunks or [text]
+
+    def __iter__(self):
+        return (StubResponse(chunk) for chunk in self._chunks)
+
+
+class StubModel:
+    """Answers instantly, in the shape of google.generativeai's GenerativeModel"""
+
+    REPLY = ("I'm here for you. Remember, tough times don't last, and you have got through hard days before. "
+             "Would you like to talk about what happened, or should we try something to take your mind off it?")
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        words = self.REPLY.split(" ")
+        chunks = [" ".join(words[i:i + 4]) + " " for i in range(0, len(words), 4)]
+        return StubResponse(self.REPLY, chunks)
+
+
+class StubTTSWorker:
+    """Accepts utterances without speaking them (each one "starts playing" when submitted)"""
+
+    class Job:
+        status = "done"
+
+        def __init__(self):
+            self.started_at = time.perf_counter()
+
+    def submit(self, text):
+        return self.Job()
+
+    def wait(self, job, timeout=None):
+        return job.status
+
+
+def measure(fn, repeat, min_time=0.05):
+    """Median and best per-call time in ms (calls are batched for tiny functions)"""
+    fn()  # warm-up
+    calls = 1
+    start = time.perf_counter()
+    fn()
+    single = time.perf_counter() - start
+    if single < min_time / 10:
+        calls = max(1, int(min_time / 10 / max(single, 1e-7)))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        samples.append((time.perf_counter() - start) / calls * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def calibrate(repeat):
+    """Time a fixed reference workload, so baselines survive machine speed changes"""
+    data = np.random.default_rng(0).standard_normal(50000).astype('float32')
+
+    def reference():
+        np.sort(data)
+        sum(i * i for i in range(5000))
+    return measure(reference, repeat)[1]
+
+
+def build_cases():
+    """(name, callable) pairs for every benchmark"""
+    from emotion_detector import EmotionStream, analyze_emotion_from_audio, analyze_emotions
+    from local_responses import get_response
+    from batch import read_wav
+    from spectral_features import extract_spectral_features
+    from emotion_model import FEATURE_NAMES, Emotion, ThresholdClassifier, train_logistic
+
+    cases = []
+    for fs in SAMPLE_RATES:
+        for duration in DURATIONS:
+            samples = synth_speech(duration, fs, seed=duration * 1000 + fs)
+            data = wav_bytes(samples, fs)
+            label = f"{duration}s@{fs // 1000}k"
+            cases.append((f"emotion/ndarray/{label}", lambda s=samples, r=fs: analyze_emotion_from_audio(s, r)))
+            cases.append((f"emotion/audiodata/{label}",
+                          lambda d=data: analyze_emotion_from_audio(StubAudioData(d))))
+            cases.append((f"decode/wav/{label}", lambda d=data: read_wav(io.BytesIO(d))))
+            cases.append((f"spectral/{label}", lambda s=samples, r=fs: extract_spectral_features(s, r).vector()))
+
+    # Many short clips in one call (offline analytics)
+    clips = [synth_speech(1, 16000, seed=i) for i in range(50)]
+    cases.append(("emotion/batch/50x1s@16k", lambda: analyze_emotions(clips)))
+
+    # Online analysis: one 30 ms capture block folded into a running stream
+    stream = EmotionStream(16000)
+    block = synth_speech(0.03, 16000, seed=7)
+    cases.append(("emotion/stream/30ms-block", lambda: stream.feed(block)))
+
+    # Classifier scoring alone, on a model fitted to random features
+    rng = np.random.default_rng(0)
+    matrix = rng.random((64, len(FEATURE_NAMES))).astype('float32')
+    model = train_logistic(matrix, rng.integers(0, 4, len(matrix)), ["a", "b", "c", "d"], iterations=10)
+    cases.append(("emotion_model/logistic", lambda v=matrix[0]: model.predict(v)))
+    cases.append(("emotion_model/thresholds", lambda v=matrix[0]: ThresholdClassifier().predict(v)))
+
+    phrases = ["hello", "who are you", "what is the capital of india", "tell me about nikola tesla",
+               "what time is it", "i am so mad right now", "blah blah nothing matches here at all"]
+    emotions = list(Emotion)
+    cases.append(("local_responses/get_response",
+                  lambda: [get_response(p, e) for p in phrases for e in emotions]))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import megan
+        import text_to_speech
+        from gemini_client import ConversationHistory, GeminiClient, ResponseCache
+
+    markdown = "**Sure!** Here's what I found:\n\n* `item one`\n* item ## two\n\n" * 5
+    cases.append(("megan/clean_text", lambda: megan.clean_text(markdown)))
+
+    def gemini_client(cache=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            client = GeminiClient(api_key="stub", cache=cache)
+        client.model = StubModel()
+        client.enabled = True
+        return client
+
+    # Each call starts from an empty history so timings don't drift as it fills up
+    def fresh(client):
+        client.history = ConversationHistory()
+        return client
+
+    client = gemini_client()
+    cases.append(("gemini/send_message", lambda: fresh(client).send_message("How was your day?", Emotion.SAD)))
+    streaming = gemini_client()
+    cases.append(("gemini/stream_sentences",
+                  lambda: list(megan.stream_sentences(fresh(streaming).stream_message("Tell me something", Emotion.NEUTRAL)))))
+    cached = gemini_client(cache=ResponseCache())
+    cached.send_message("what can you do", Emotion.NEUTRAL)
+    cases.append(("gemini/cache_hit", lambda: fresh(cached).send_message("What can you do?", Emotion.NEUTRAL)))
+
+    def tts_stream():
+        with contextlib.redirect_stdout(io.StringIO()):
+            megan.respond_streaming(fresh(streaming), "Tell me something", Emotion.NEUTRAL)
+
+    text_to_speech._worker = StubTTSWorker()
+    text_to_speech.is_tts_available.set(True)
+    cases.append(("tts/respond_streaming", tts_stream))
+    return cases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MEGAN pipeline stages.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="flag cases slower than baseline by more than this fraction (default 0.25)")
+    parser.add_argument("--repeat", type=int, default=7, help="timed repetitions per case")
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose name contains this")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Compare best-of-N times, scaled by how fast this machine runs the reference workload
+    calibration = calibrate(args.repeat)
+    scale = calibration / baseline["_calibration_ms"] if "_calibration_ms" in baseline else 1.0
+    results = {"_calibration_ms": calibration}
+    regressions = []
+    print(f"Machine speed vs baseline: {1 / scale:.2f}x\n")
+    print(f"{'case':<36}{'median ms':>11}{'best ms':>10}{'expected':>10}{'change':>9}")
+    for name, fn in build_cases():
+        if name.startswith("_") or args.filter not in name:
+            continue
+        median, best = measure(fn, args.repeat)
+        results[name] = {"median_ms": median, "best_ms": best}
+        line = f"{name:<36}{median:>11.3f}{best:>10.3f}"
+        if name in baseline:
+            base = baseline[name]["best_ms"] * scale
+            change = (best - base) / base if base else 0.0
+            flag = "  REGRESSION" if change > args.threshold else ""
+            if flag:
+                regressions.append(name)
+            line += f"{base:>10.3f}{change:>+9.0%}{flag}"
+        print(line)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n✗ {len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    elif baseline:
+        print("\n✓ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
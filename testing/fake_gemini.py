@@ -0,0 +1,202 @@
+"""Local fake Gemini endpoint for exercising GeminiClient retries and the circuit breaker.
+
+Speaks just enough of the Generative Language REST API (generateContent and
+streamGenerateContent) for google-generativeai with transport="rest".
+Run directly to check timeouts, backoff and breaker recovery without a real API key.
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, '.')
+
+
+class FakeGemini:
+    """Tiny HTTP server; queue failures with fail_next() and slow it down with delay"""
+
+    def __init__(self, reply="Hi, I'm Megan. How can I help you today?"):
+        self.reply = reply
+        self.delay = 0.0
+        self.requests = 0
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def fail_next(self, count, status=429):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _next_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                with fake._lock:
+                    fake.requests += 1
+                if fake.delay:
+                    time.sleep(fake.delay)
+
+                status = fake._next_failure()
+                if status is not None:
+                    body = {"error": {"code": status, "message": f"fake failure {status}",
+                                      "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}}
+                    self._send_json(status, body)
+                    return
+
+                if ":streamGenerateContent" in self.path:
+                    words = fake.reply.split(" ")
+                    chunks = [" ".join(words[i:i + 3]) + " " for i in range(0, len(words), 3)]
+                    self._send_json(200, [self._candidate(c) for c in chunks])
+                else:
+                    self._send_json(200, self._candidate(fake.reply))
+
+            def _candidate(self, text):
+                return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                        "finishReason": "STOP", "index": 0}]}
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout test)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+if __name__ == "__main__":
+    import gemini_client
+    from gemini_client import CircuitBreaker, GeminiClient
+
+    # Keep the run short
+    gemini_client.BACKOFF_BASE_S = 0.05
+    gemini_client.REQUEST_TIMEOUT_S = 1
+
+    fake = FakeGemini()
+    url = fake.start()
+    client = GeminiClient(api_key="fake-key", endpoint=url, breaker=CircuitBreaker(cooldown=0.5))
+    assert client.available, "client did not initialise against the fake endpoint"
+
+    print("1. Retries past two 429s")
+    fake.fail_next(2, 429)
+    reply = client.send_message("hello")
+    assert reply == fake.reply, reply
+    print(f"   ✓ {fake.requests} requests, reply: {reply}")
+
+    print("2. Streams chunks after a 503")
+    fake.fail_next(1, 503)
+    chunks = list(client.stream_message("hello again"))
+    assert "".join(chunks).strip() == fake.reply, chunks
+    print(f"   ✓ {len(chunks)} chunks")
+
+    print("3. Async request respects its deadline")
+    fake.delay = 2.0
+    start = time.monotonic()
+    reply = asyncio.run(client.send_message_async("slow", deadline=1.5))
+    elapsed = time.monotonic() - start
+    assert reply is None and elapsed < 2.5, (reply, elapsed)
+    fake.delay = 0.0
+    print(f"   ✓ gave up after {elapsed:.2f}s")
+
+    print("4. Breaker opens, then half-opens and recovers")
+    fake.fail_next(100, 500)
+    while client.breaker.state != CircuitBreaker.OPEN:
+        assert client.send_message("failing") is None
+    assert not client.available
+    with fake._lock:
+        fake._failures.clear()
+    time.sleep(0.6)
+    assert client.available
+    assert client.send_message("recovered?") == fake.reply
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    print("   ✓ breaker closed again")
+
+    print("5. Repeated questions come from the response cache, follow-ups only in the same context")
+    from gemini_client import ResponseCache
+    client.cache = ResponseCache()
+    before = fake.requests
+    first = client.new_session().send_message("What can you do?", "happy/energetic (energy=0.0030)")
+    second = client.new_session().send_message("what can you do", "happy/energetic (energy=0.0051)")
+    client.new_session().send_message("What time is it?")
+    client.new_session().send_message("What time is it?")
+    assert first == second and fake.requests - before == 3, fake.requests - before
+    chat = client.new_session()
+    chat.send_message("I just adopted a cat")
+    chat.send_message("why?")
+    other = client.new_session()
+    other.send_message("I lost my job")
+    other.send_message("why?")
+    assert fake.requests - before == 7, fake.requests - before
+    print(f"   ✓ {client.cache.stats()}")
+
+    print("6. An abandoned half-open trial doesn't leave the breaker stuck")
+    def trip_and_cool_down():
+        fake.fail_next(100, 500)
+        while client.breaker.state != CircuitBreaker.OPEN:
+            client.send_message("failing again")
+        with fake._lock:
+            fake._failures.clear()
+        time.sleep(0.6)
+
+    trip_and_cool_down()
+    stream = client.stream_message("tell me a long story")
+    next(stream)
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+    stream.close()  # caller stops reading mid-reply (barge-in)
+    assert client.breaker.state == CircuitBreaker.OPEN, client.breaker.state
+    time.sleep(0.6)
+    assert client.send_message("back after a closed stream?") == fake.reply
+    print("   ✓ closed stream reopened the breaker, next trial succeeded")
+
+    async def cancelled_trial():
+        fake.delay = 1.0
+        task = asyncio.ensure_future(client.send_message_async("cancel me"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        fake.delay = 0.0
+
+    trip_and_cool_down()
+    asyncio.run(cancelled_trial())
+    assert client.breaker.state == CircuitBreaker.OPEN, client.breaker.state
+    time.sleep(0.6)
+    assert client.send_message("back after a cancelled task?") == fake.reply
+    print("   ✓ cancelled task reopened the breaker, next trial succeeded")
+
+    print("7. Server sessions sharing one cache never get each other's replies")
+    alice, bob = client.new_session(), client.new_session()
+    alice.send_message("My name is Alice")
+    bob.send_message("My name is Bob")
+    before = fake.requests
+    alice.send_message("What's my name?")
+    bob.send_message("What's my name?")
+    assert fake.requests - before == 2, fake.requests - before
+    print("   ✓ the same follow-up from two sessions went to the model twice")
+
+    fake.stop()
+    print("\n✓ All fake Gemini checks passed!")
@@ -0,0 +1,179 @@
+"""Load test for the MEGAN HTTP server: many concurrent sessions, each sending voice turns.
+
+Every virtual client opens a session on its own keep-alive connection and
+sends synthetic utterances (WAV) with a reference transcript, so the numbers
+cover the server's decode, emotion, responder and TTS stages without an ASR
+network round trip.
+
+    python testing/load_test.py --local --sessions 200      # start a server and load it
+    python testing/load_test.py --url http://127.0.0.1:8765  # load a running server
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from benchmark import synth_speech, wav_bytes
+
+PHRASES = ["hello", "what can you do", "tell me a joke", "who are you", "i feel a bit down today",
+           "what is the capital of india", "thank you"]
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client for JSON responses"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=b"", headers=None):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return status, json.loads(data) if data else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def client(index, host, port, turns, utterances, think, audio, results, start_gate):
+    conn = Connection(host, port)
+    await start_gate.wait()
+    try:
+        await conn.open()
+        status, body = await conn.request("POST", "/sessions")
+        if status != 201:
+            results["errors"].append(f"session: HTTP {status} {body}")
+            return
+        session = body["session"]
+        for turn in range(turns):
+            wav = utterances[(index + turn) % len(utterances)]
+            phrase = PHRASES[(index + turn) % len(PHRASES)]
+            sent = time.perf_counter()
+            status, body = await conn.request(
+                "POST", f"/sessions/{session}/turn?audio={int(audio)}", wav,
+                {"Content-Type": "audio/wav", "X-Transcript": phrase})
+            latency = time.perf_counter() - sent
+            if status != 200 or not body.get("reply"):
+                results["errors"].append(f"turn: HTTP {status} {body}")
+            else:
+                results["latency"].append(latency)
+                for stage, ms in body["timings_ms"].items():
+                    results["stages"].setdefault(stage, []).append(ms)
+            if think:
+                await asyncio.sleep(think)
+        await conn.request("DELETE", f"/sessions/{session}")
+    except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+        results["errors"].append(f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+
+
+async def run(host, port, sessions, turns, utterances, think, audio):
+    results = {"latency": [], "stages": {}, "errors": []}
+    start_gate = asyncio.Event()
+    tasks = [asyncio.ensure_future(client(i, host, port, turns, utterances, think, audio, results, start_gate))
+             for i in range(sessions)]
+    start = time.perf_counter()
+    start_gate.set()
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def report(results, wall, sessions):
+    latency = np.array(results["latency"]) * 1000
+    n = len(latency)
+    print(f"\n{sessions} sessions, {n} turns in {wall:.2f}s "
+          f"({n / wall if wall else 0:.1f} turns/sec), {len(results['errors'])} errors")
+    if n:
+        p50, p90, p99 = np.percentile(latency, [50, 90, 99])
+        print(f"turn latency ms: p50 {p50:.1f}  p90 {p90:.1f}  p99 {p99:.1f}  max {latency.max():.1f}")
+        print("server stage ms (median): " + ", ".join(
+            f"{stage} {statistics.median(values):.1f}" for stage, values in results["stages"].items()))
+    for error in results["errors"][:5]:
+        print(f"  error: {error}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_local_server(args):
+    """Start server.py in a subprocess (no ASR network calls, local responder)"""
+    port = free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server.py"),
+               "--port", str(port), "--asr", "none", "--responder", "local",
+               "--max-sessions", str(max(args.sessions, 1000))]
+    if not args.audio:
+        command.append("--no-tts")
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in proc.stdout:
+        if line.startswith("[Serving on"):
+            return proc, port
+    raise RuntimeError("server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--local", action="store_true", help="start a local server.py for the test")
+    parser.add_argument("--sessions", type=int, default=100, help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--duration", type=float, default=2.0, help="utterance length in seconds")
+    parser.add_argument("--think", type=float, default=0.0, help="pause between a session's turns (s)")
+    parser.add_argument("--audio", action="store_true", help="ask for synthesized reply audio")
+    args = parser.parse_args()
+
+    proc = None
+    if args.local:
+        proc, port = start_local_server(args)
+        host = "127.0.0.1"
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+
+    utterances = [wav_bytes(synth_speech(args.duration, 16000, seed=i, level=0.1 + 0.1 * i), 16000)
+                  for i in range(5)]
+    try:
+        results, wall = asyncio.run(run(host, port, args.sessions, args.turns, utterances, args.think, args.audio))
+        report(results, wall, args.sessions)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(5)
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
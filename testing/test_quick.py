@@ -6,28 +6,26 @@ sys.path.insert(0, '.')
 class MockAudio:
     def get_wav_data(self):
         # Return a simple 1-second 16kHz mono WAV with some test samples
-        import struct
         import io
         import wave
-        
+        import numpy as np
+
         # Create a simple tone
-        samples = []
-        for i in range(16000):
-            val = int(10000 * (i % 100) / 100)  # sawtooth wave
-            samples.append(val)
-        
+        samples = (10000 * (np.arange(16000) % 100) // 100).astype('<i2')  # sawtooth wave
+
         # Build WAV
         buf = io.BytesIO()
         with wave.open(buf, 'wb') as wf:
             wf.setnchannels(1)
             wf.setsampwidth(2)
             wf.setframerate(16000)
-            wf.writeframes(struct.pack(f'<{len(samples)}h', *samples))
-        
+            wf.writeframes(samples.tobytes())
+
         return buf.getvalue()
 
 # Test emotion analyzer
-from meggan import analyze_emotion_from_audio, local_responder
+from emotion_detector import analyze_emotion_from_audio
+from local_responses import get_response as local_responder
 
 audio = MockAudio()
 emotion = analyze_emotion_from_audio(audio)
@@ -48,4 +46,15 @@ for phrase, emo in test_phrases:
     print(f"  Input: '{phrase}' | Emotion: {emo}")
     print(f"  Response: {response}\n")
 
+# Questions nobody answers get the generic question reply, not a greeting or
+# the angry_at_me reply that their other words would trigger
+from local_responses import UNKNOWN_QUESTION
+for phrase in ["hi what is up", "hello who is that", "why am I so angry", "I am mad why"]:
+    response = local_responder(phrase, "neutral")
+    assert response == UNKNOWN_QUESTION, (phrase, response)
+    print(f"  Input: '{phrase}' -> generic question reply")
+assert local_responder("hello", "neutral") == "Hello! How can I help you today?"
+assert local_responder("how are you", "neutral").startswith("I'm doing well")
+assert local_responder("what is the capital of india", "neutral") == "The capital of India is New Delhi!"
+
 print("✓ All tests passed!")
@@ -2,79 +2,843 @@
 Text-to-Speech Module
 Handles voice output
 """
-import subprocess
-import sys
+import atexit
+import hashlib
+import itertools
+import multiprocessing
+import os
+import queue
+import re
+import tempfile
+import threading
 import time
+from collections import OrderedDict
 
-try:
-    import sounddevice as sd
-except:
-    sd = None
+import lazy
+import tracing
+import wav_decoder
 
-try:
-    import pyttsx3
+np = lazy.lazy_import("numpy")
+sd = lazy.lazy_import("sounddevice")
+pyttsx3 = lazy.lazy_import("pyttsx3")
+
+
+def _probe_engine():
     # Test initialization
+    engine = pyttsx3.init()
+    engine.stop()
+    return True
+
+
+# is_tts_available() initialises a throwaway engine the first time it is called
+# (normally on the start-up warm-up thread) and caches the answer
+is_tts_available = lazy.Probe("pyttsx3 engine", _probe_engine)
+
+
+# Voice settings
+TTS_RATE = 150
+TTS_VOLUME = 1.0
+TTS_VOICE = os.getenv("MEGAN_TTS_VOICE")  # engine voice id; None keeps the system default
+
+GOODBYE = "Goodbye! Have a nice day."
+
+# Attempts at rendering one phrase while prewarming before giving up on the engine
+PREWARM_ATTEMPTS = 3
+
+# Renders are written to tmpfs where there is one, so they go from memory to memory
+_RENDER_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+# Sentence boundary: terminal punctuation (plus closing quotes/brackets) and
+# whitespace, or a line break
+_SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n+')
+_ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "st.", "vs.", "etc.", "e.g.", "i.e."}
+
+
+class SentenceSegmenter:
+    """Split streamed text into complete sentences as soon as they end."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, chunk):
+        """Add a chunk of text and return any sentences it completed."""
+        self._buffer += chunk
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            words = sentence.split()
+            if "\n" not in match.group() and words and words[-1].lower() in _ABBREVIATIONS:
+                continue
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever is left once the stream has ended."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+def _tts_worker_main(jobs, results):
+    """Worker process: initialise pyttsx3 once, then speak queued utterances.
+
+    Runs in its own interpreter so a misbehaving engine cannot take the
+    assistant down with it. Each job is (job_id, text, path): with a path
+    the utterance is rendered to that audio file instead of played. Each result is
+    (job_id, status) with status "done" or "error: ...",
+    preceded by (job_id, "started") when the engine begins speaking it.
+    """
+    import pyttsx3
+
+    engine = pyttsx3.init()
+    engine.setProperty("rate", TTS_RATE)
+    engine.setProperty("volume", TTS_VOLUME)
+    if TTS_VOICE:
+        engine.setProperty("voice", TTS_VOICE)
+
+    results.put((None, "ready"))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, text, path = job
+        try:
+            if path is None:
+                engine.say(text)
+            else:
+                engine.save_to_file(text, path)
+            results.put((job_id, "started"))
+            engine.runAndWait()
+            results.put((job_id, "done"))
+        except Exception as e:
+            results.put((job_id, f"error: {e}"))
+
+    engine.stop()
+
+
+class _Job:
+    def __init__(self, job_id, plays=True):
+        self.id = job_id
+        self.plays = plays  # False for renders to a file
+        self.status = None
+        self.started_at = None  # perf_counter() when playback began
+        self.finished = threading.Event()
+
+    def finish(self, status):
+        if not self.finished.is_set():
+            self.status = status
+            self.finished.set()
+
+
+class TTSWorker:
+    """Long-lived TTS process fed through a job queue.
+
+    The process is started on first use and restarted automatically if it
+    dies. Utterances are spoken in submission order.
+    """
+
+    def __init__(self):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._proc = None
+        self._jobs = None
+        self._results = None
+        self._pending = {}
+        self._reader = None
+
+    def start(self):
+        """Start the worker process if it is not already running."""
+        with self._lock:
+            if self._proc is not None and self._proc.is_alive():
+                return
+            self._spawn()
+
+    def _spawn(self):
+        self._fail_pending("error: TTS worker restarted")
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._proc = self._ctx.Process(
+            target=_tts_worker_main,
+            args=(self._jobs, self._results),
+            daemon=True,
+        )
+        self._proc.start()
+        self._reader = threading.Thread(
+            target=self._read_results, args=(self._proc, self._results), daemon=True
+        )
+        self._reader.start()
+
+    def _read_results(self, proc, results):
+        while True:
+            try:
+                job_id, status = results.get(timeout=0.2)
+            except queue.Empty:
+                if not proc.is_alive():
+                    break
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                if status == "started":
+                    job = self._pending.get(job_id)
+                    if job is not None:
+                        job.started_at = time.perf_counter()
+                    continue
+                job = self._pending.pop(job_id, None)
+            if job is not None:
+                job.finish(status)
+        with self._lock:
+            if proc is self._proc:
+                self._fail_pending("error: TTS worker exited")
+
+    def _fail_pending(self, status):
+        pending, self._pending = self._pending, {}
+        for job in pending.values():
+            job.finish(status)
+
+    @property
+    def busy(self):
+        """True while utterances are queued or being spoken (renders don't count)."""
+        return any(job.plays for job in list(self._pending.values()))
+
+    def submit(self, text, path=None):
+        """Queue `text` for speaking (or rendering to the audio file `path`)
+        and return a job handle without waiting."""
+        with self._lock:
+            if self._proc is None or not self._proc.is_alive():
+                self._spawn()
+            job = _Job(next(self._ids), plays=path is None)
+            self._pending[job.id] = job
+            self._jobs.put((job.id, text, path))
+        return job
+
+    def wait(self, job, timeout=None):
+        """Wait for a job to finish; returns its status or None on timeout."""
+        if job.finished.wait(timeout):
+            return job.status
+        return None
+
+    def say(self, text, timeout=30):
+        """Speak `text` and block until it has been spoken.
+
+        A worker that overruns `timeout` is killed and restarted.
+        """
+        job = self.submit(text)
+        status = self.wait(job, timeout)
+        if status is None:
+            self.restart()
+            return "error: TTS timed out"
+        return status
+
+    def render(self, text, timeout=30):
+        """Synthesize `text` without playing it; returns the audio file's bytes
+        (WAV with the SAPI and eSpeak drivers) or None on failure.
+        """
+        fd, path = tempfile.mkstemp(prefix="megan-tts-", suffix=".wav", dir=_RENDER_DIR)
+        os.close(fd)
+        try:
+            job = self.submit(text, path)
+            status = self.wait(job, timeout)
+            if status is None:
+                self.restart()
+                return None
+            if status != "done":
+                return None
+            with open(path, "rb") as f:
+                return f.read() or None
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def interrupt(self):
+        """Silence the worker at once: kill the process, drop everything queued
+        (reported as cancelled) and start a fresh one for the next reply.
+
+        Does nothing while the worker is only rendering (no utterance queued
+        or playing), so a background render is not thrown away.
+        """
+        with self._lock:
+            if self._proc is None or not any(job.plays for job in self._pending.values()):
+                return
+            self._fail_pending("cancelled")
+            self._terminate()
+            self._spawn()
+
+    def restart(self):
+        """Kill the worker process and start a fresh one."""
+        with self._lock:
+            self._terminate()
+            self._spawn()
+
+    def _terminate(self):
+        if self._proc is not None and self._proc.is_alive():
+            self._proc.terminate()
+            self._proc.join(1)
+
+    def shutdown(self):
+        """Ask the worker to exit, killing it if it does not."""
+        with self._lock:
+            if self._proc is None:
+                return
+            try:
+                self._jobs.put(None)
+                self._proc.join(2)
+            except Exception:
+                pass
+            self._terminate()
+            self._fail_pending("cancelled")
+            self._proc = None
+
+
+# Render pool for server and batch modes
+TTS_POOL_SIZE = os.cpu_count() or 1
+TTS_POOL_QUEUE = 64  # jobs waiting for a worker; submit() blocks beyond this
+RENDER_DEADLINE_S = 30
+
+
+class PoolFull(Exception):
+    pass
+
+
+class RenderJob:
+    """Handle for one pooled render; `data` holds the WAV bytes once it is done"""
+
+    def __init__(self, text, deadline):
+        self.text = text
+        self.deadline = deadline  # perf_counter() by which it must be rendered, or None
+        self.data = None
+        self.status = None
+        self.render_time = None  # seconds spent in a worker
+        self.finished = threading.Event()
+
+    def finish(self, status, data=None):
+        self.data = data
+        self.status = status
+        self.finished.set()
+
+    def wait(self, timeout=None):
+        """WAV bytes, or None if the render failed, missed its deadline or `timeout` ran out"""
+        self.finished.wait(timeout)
+        return self.data
+
+
+class TTSPool:
+    """Several TTS worker processes rendering from one bounded job queue.
+
+    Each process renders one utterance at a time, so throughput grows with
+    the number of workers up to the number of cores. submit() blocks while
+    the queue is full (backpressure); a job still queued at its deadline is
+    dropped, and a worker that overruns one is killed and restarted.
+    """
+
+    def __init__(self, size=TTS_POOL_SIZE, max_queued=TTS_POOL_QUEUE):
+        self.size = max(1, size)
+        self._queue = queue.Queue(max_queued)
+        self._lock = threading.Lock()
+        self._workers = []
+        self._threads = []
+        self._active = 0
+
+    def start(self):
+        """Start the worker processes if they are not already running."""
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(self.size):
+                worker = TTSWorker()
+                worker.start()
+                thread = threading.Thread(target=self._dispatch, args=(worker,),
+                                          name=f"megan-tts-pool-{index}", daemon=True)
+                thread.start()
+                self._workers.append(worker)
+                self._threads.append(thread)
+
+    def _dispatch(self, worker):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if job.deadline is None:
+                remaining = RENDER_DEADLINE_S
+            else:
+                remaining = job.deadline - time.perf_counter()
+            if remaining <= 0:
+                job.finish("error: deadline exceeded")
+                continue
+            with self._lock:
+                self._active += 1
+            start = time.perf_counter()
+            try:
+                data = worker.render(job.text, timeout=remaining)
+            except Exception as e:
+                data = None
+                job.status = f"error: {e}"
+            finally:
+                with self._lock:
+                    self._active -= 1
+            job.render_time = time.perf_counter() - start
+            job.finish("done" if data else job.status or "error: render failed", data)
+
+    @property
+    def busy(self):
+        """True while every worker is rendering or jobs are waiting"""
+        return self._active >= self.size or not self._queue.empty()
+
+    def submit(self, text, deadline=RENDER_DEADLINE_S, timeout=None):
+        """Queue `text` for rendering within `deadline` seconds and return its RenderJob.
+
+        With `deadline` None the job may wait in the queue indefinitely (the
+        render itself still gets RENDER_DEADLINE_S). Waits up to `timeout`
+        (forever if None) for room in the queue, then raises PoolFull.
+        """
+        self.start()
+        job = RenderJob(text, None if deadline is None else time.perf_counter() + deadline)
+        try:
+            self._queue.put(job, timeout=timeout)
+        except queue.Full:
+            raise PoolFull(f"TTS queue is full ({self._queue.maxsize} jobs waiting)")
+        return job
+
+    def render(self, text, timeout=RENDER_DEADLINE_S):
+        """Render `text` and return the WAV bytes, or None (failure, deadline or full queue)"""
+        start = time.perf_counter()
+        try:
+            job = self.submit(text, deadline=timeout, timeout=timeout)
+        except PoolFull:
+            return None
+        return job.wait(max(0.0, timeout - (time.perf_counter() - start)))
+
+    def shutdown(self):
+        """Drop queued jobs and stop the worker processes."""
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.finish("cancelled")
+        with self._lock:
+            workers, self._workers = self._workers, []
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for worker in workers:
+            worker.shutdown()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_tts_worker():
+    """Return the shared TTS worker, creating it on first use."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = TTSWorker()
+            atexit.register(_worker.shutdown)
+        return _worker
+
+
+def start_tts_worker():
+    """Start the TTS worker ahead of the first utterance."""
+    if is_tts_available():
+        get_tts_worker().start()
+
+
+def is_speaking():
+    """True while the TTS worker has speech queued or playing, or cached audio is playing."""
+    return (_worker is not None and _worker.busy) or _player.playing
+
+
+def cancel_speech():
+    """Interrupt whatever is being spoken, within a few milliseconds (barge-in).
+
+    Cached audio stops at the next output block; live speech is cut by
+    killing the worker process, which is restarted in the background.
+    """
+    _player.cancel()
+    if _worker is not None:
+        _worker.interrupt()
+
+
+# Rendered-speech cache: an in-memory LRU over a directory of WAV files that
+# survives restarts (MEGAN_TTS_CACHE; set it empty to keep the cache in memory)
+SPEECH_CACHE_DIR = os.getenv("MEGAN_TTS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "megan", "tts"))
+SPEECH_CACHE_BYTES = 64 * 1024 * 1024
+SPEECH_CACHE_FILES = 2000
+
+
+class SpeechCache:
+    """Content-addressed cache of rendered utterances (WAV bytes).
+
+    Keyed on a hash of the text and the voice settings, so changing the
+    voice or rate never plays stale audio. The memory tier is bounded by
+    total size; the disk tier keeps the most recently used files.
+    """
+
+    def __init__(self, path=SPEECH_CACHE_DIR, max_bytes=SPEECH_CACHE_BYTES, max_files=SPEECH_CACHE_FILES):
+        self.path = path or None
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+            except OSError as e:
+                print(f"[WARNING] TTS cache directory unavailable ({e}); caching in memory only")
+                self.path = None
+
+    @staticmethod
+    def key(text, voice=TTS_VOICE, rate=TTS_RATE, volume=TTS_VOLUME):
+        text = " ".join(text.split())
+        return hashlib.sha256(f"{voice or 'default'}|{rate}|{volume}|{text}".encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".wav")
+
+    def __contains__(self, text):
+        key = self.key(text)
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.path is not None and os.path.exists(self._file(key))
+
+    def get(self, text):
+        """Cached WAV bytes for `text`, or None"""
+        key = self.key(text)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, text, data):
+        if not data:
+            return
+        key = self.key(text)
+        with self._lock:
+            self._store(key, data)
+        self._write(key, data)
+
+    def _store(self, key, data):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._bytes -= len(self._entries.popitem(last=False)[1])
+
+    def _read(self, key):
+        if self.path is None:
+            return None
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+            os.utime(self._file(key))  # recency for pruning
+            return data or None
+        except OSError:
+            return None
+
+    def _write(self, key, data):
+        if self.path is None:
+            return
+        # Write under a temporary name first so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self._prune()
+
+    def _prune(self):
+        try:
+            files = [entry for entry in os.scandir(self.path) if entry.name.endswith(".wav")]
+            if len(files) <= self.max_files:
+                return
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:len(files) - self.max_files]:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "bytes": self._bytes}
+
+
+_cache = None
+
+
+def get_speech_cache():
+    """Return the shared speech cache, creating it on first use."""
+    global _cache
+    with _worker_lock:
+        if _cache is None:
+            _cache = SpeechCache()
+        return _cache
+
+
+def _rendered(text, timeout=30, span=None, renderer=None, store=True):
+    """WAV bytes for `text` from the speech cache, rendered (and stored, with
+    `store`) on a miss. `renderer` is a TTSPool, or None for the shared worker."""
+    cache = get_speech_cache()
+    data = cache.get(text)
+    if span is not None:
+        span.set("cached", data is not None)
+    if data is None:
+        data = (renderer or get_tts_worker()).render(text, timeout=timeout)
+        if store:
+            cache.put(text, data)
+    return data
+
+
+class _Player:
+    """Plays WAV bytes through a sounddevice output stream.
+
+    The samples are handed to the stream straight from the decoded buffer
+    (int16 files without conversion); cancel() silences it at the next block.
+    """
+
+    def __init__(self):
+        self._cancel = threading.Event()
+        self.playing = False
+
+    def play(self, data, timeout=30):
+        """Play WAV bytes to the end; returns "done", "cancelled" or "error: ..." """
+        wav = wav_decoder.decode(data)
+        if wav.format.sample_width == 2 and not wav.format.is_float:
+            frames = wav.samples
+        else:
+            frames = np.stack([wav.to_float32(channel) for channel in range(wav.channels)], axis=1)
+        if not len(frames):
+            return "done"
+
+        position = 0
+        finished = threading.Event()
+
+        def callback(outdata, n_frames, time_info, status):
+            nonlocal position
+            if self._cancel.is_set():
+                outdata.fill(0)
+                raise sd.CallbackAbort
+            chunk = frames[position:position + n_frames]
+            position += len(chunk)
+            outdata[:len(chunk)] = chunk
+            outdata[len(chunk):] = 0
+            if len(chunk) < n_frames:
+                raise sd.CallbackStop
+
+        self._cancel.clear()
+        self.playing = True
+        try:
+            with sd.OutputStream(samplerate=wav.framerate, channels=frames.shape[1], dtype=frames.dtype.name,
+                                 callback=callback, finished_callback=finished.set):
+                if not finished.wait(timeout):
+                    return "error: playback timed out"
+        finally:
+            self.playing = False
+        return "cancelled" if self._cancel.is_set() else "done"
+
+    def cancel(self):
+        self._cancel.set()
+
+
+_player = _Player()
+
+
+def _play_cached(text, span=None):
+    """Speak `text` from the speech cache, rendering it first on a miss.
+
+    Returns the playback status, or None when there is no audio output or
+    the engine cannot render (the caller then speaks it live).
+    """
+    if not lazy.available(sd):
+        return None
+    data = _rendered(text, span=span)
+    if data is None:
+        return None
     try:
-        _test_engine = pyttsx3.init()
-        _test_engine.stop()
-        del _test_engine
-        tts_available = True
-    except:
-        tts_available = False
-except:
-    pyttsx3 = None
-    tts_available = False
+        return _player.play(data)
+    except Exception as e:
+        # e.g. a driver that saves AIFF instead of WAV, or no output device
+        if span is not None:
+            span.set("cache_error", str(e))
+        return None
+
+
+def prewarm_speech_cache(texts, renderer=None):
+    """Render whichever of `texts` are not cached yet, on a background thread.
+
+    Renders share the worker (or `renderer` pool) with live requests, so each
+    one waits until it is idle; one cut short by a barge-in is tried again.
+    Returns the thread (None without TTS).
+    """
+    if not is_tts_available():
+        return None
+    cache = get_speech_cache()
+    renderer = renderer or get_tts_worker()
+
+    def run():
+        for text in texts:
+            if text in cache:
+                continue
+            for _ in range(PREWARM_ATTEMPTS):
+                while renderer.busy or _player.playing:
+                    time.sleep(0.1)
+                data = renderer.render(text, timeout=30)
+                if data is not None:
+                    cache.put(text, data)
+                    break
+            else:
+                return  # this engine cannot render; nothing to gain from the rest
+
+    thread = threading.Thread(target=run, name="megan-tts-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def render_speech(text, max_length=500, timeout=30, renderer=None, cache=False):
+    """Synthesize text to audio bytes (for clients that play it themselves), or None.
+    Served from the speech cache when the same text was rendered before; otherwise
+    rendered on `renderer` (a TTSPool) or the shared worker, and kept in the cache
+    only with `cache` (for replies that recur verbatim)."""
+    if not is_tts_available():
+        return None
+    if len(text) > max_length:
+        text = text[:max_length] + "..."
+    with tracing.span("tts", chars=len(text), rendered=True) as span:
+        data = _rendered(text, timeout=timeout, span=span, renderer=renderer, store=cache)
+        span.set("status", "done" if data else "error")
+    return data
+
 
+def speak(text, max_length=500, cache=False):
+    """Speak the given text using TTS.
 
-def speak(text, max_length=500):
-    """Speak the given text using TTS"""
-    if not tts_available:
+    With `cache`, the utterance is played from the speech cache (rendered
+    into it first if needed); use it for replies that recur verbatim.
+    """
+    if not is_tts_available():
         return False
-        
+
     try:
         print("[Speaking...]", end="", flush=True)
-        
-        # Stop any sounddevice streams before TTS
-        if sd is not None:
-            try:
-                sd.stop()
-            except:
-                pass
-        
-        time.sleep(0.3)
-        
+
         # Split long responses into chunks if needed
         speak_text = text
         if len(text) > max_length:
             speak_text = text[:max_length] + "..."
-        
-        # Use subprocess to run TTS in isolation
-        tts_code = f'''
-import pyttsx3
-engine = pyttsx3.init()
-engine.setProperty("rate", 150)
-engine.setProperty("volume", 1.0)
-engine.say({repr(speak_text)})
-engine.runAndWait()
-engine.stop()
-'''
-        
-        # Run TTS in separate process
-        result = subprocess.run(
-            [sys.executable, "-c", tts_code],
-            capture_output=True,
-            timeout=30
-        )
-        
-        if result.returncode != 0:
-            print(f"\n[TTS error: {result.stderr.decode()}]")
+
+        with tracing.span("tts", chars=len(speak_text)) as span:
+            status = _play_cached(speak_text, span) if cache else None
+            if status is None:
+                status = get_tts_worker().say(speak_text, timeout=30)
+            span.set("status", status)
+
+        if status == "cancelled":
+            print(" [Interrupted]")
             return False
-        else:
-            print(" [Done]")
-        
-        # Pause to ensure audio device is fully released
-        time.sleep(0.8)
+        if status != "done":
+            print(f"\n[TTS {status}]")
+            return False
+        print(" [Done]")
         return True
+    except KeyboardInterrupt:
+        cancel_speech()
+        raise
+    except Exception as e:
+        print(f"\nTTS error: {e}")
+        return False
+
+
+def speak_stream(sentences, max_length=500):
+    """Speak sentences as they arrive from an iterator.
+
+    Each sentence is queued on the TTS worker immediately, so the first one
+    plays while later ones are still being produced. Speech stops after
+    `max_length` characters; the iterator is still consumed to the end.
+    """
+    if not is_tts_available():
+        for _ in sentences:
+            pass
+        return False
+
+    try:
+        worker = get_tts_worker()
+        jobs = []
+        span = None
+        budget = max_length
+        for sentence in sentences:
+            if budget <= 0:
+                continue
+            if len(sentence) > budget:
+                sentence = sentence[:budget] + "..."
+            budget -= len(sentence)
+            if span is None:
+                # Timed from the first sentence; waiting for the reply belongs to Gemini
+                span = tracing.span("tts", streamed=True)
+                submitted = time.perf_counter()
+            jobs.append(worker.submit(sentence))
+
+        if not jobs:
+            return False
+
+        print("[Speaking...]", end="", flush=True)
+        status = "done"
+        for job in jobs:
+            status = worker.wait(job, timeout=30)
+            if status != "done":
+                break
+
+        span.set("sentences", len(jobs))
+        span.set("chars", max_length - max(budget, 0))
+        span.set("status", status)
+        if jobs[0].started_at is not None:
+            span.set("first_audio_ms", round((jobs[0].started_at - submitted) * 1000, 1))
+        span.end()
+
+        if status is None:
+            worker.restart()
+            status = "error: TTS timed out"
+        if status == "cancelled":
+            print(" [Interrupted]")
+            return False
+        if status != "done":
+            print(f"\n[TTS {status}]")
+            return False
+        print(" [Done]")
+        return True
+    except KeyboardInterrupt:
+        cancel_speech()
+        raise
     except Exception as e:
         print(f"\nTTS error: {e}")
         return False
@@ -82,26 +846,11 @@ engine.stop()
 
 def speak_goodbye():
     """Speak goodbye message"""
-    if not tts_available:
+    if not is_tts_available():
         return
-        
+
     try:
-        if sd is not None:
-            try:
-                sd.stop()
-            except:
-                pass
-        time.sleep(0.3)
-        
-        tts_code = '''
-import pyttsx3
-engine = pyttsx3.init()
-engine.setProperty("rate", 150)
-engine.setProperty("volume", 1.0)
-engine.say("Goodbye! Have a nice day.")
-engine.runAndWait()
-engine.stop()
-'''
-        subprocess.run([sys.executable, "-c", tts_code], capture_output=True, timeout=10)
+        if _play_cached(GOODBYE) is None:
+            get_tts_worker().say(GOODBYE, timeout=10)
     except:
         pass
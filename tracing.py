@@ -0,0 +1,302 @@
+"""
+Tracing Module
+Per-turn stage timings (wall and CPU time) exported as JSONL and Prometheus metrics
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Histogram bucket bounds (seconds) for the Prometheus endpoint
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Per-turn stage totals kept for turn_summary()
+RECENT_TURNS = 8
+
+# Turn the calling thread or asyncio task is working on (set by new_turn /
+# set_turn); each thread and each task sees its own value
+_turn = contextvars.ContextVar("megan_turn", default=0)
+
+
+class Span:
+    """One timed stage. Use as a context manager, or call end() explicitly.
+
+    CPU time is the calling thread's, so a span must end on the thread that
+    started it. Extra attributes are added with set().
+    """
+
+    __slots__ = ("name", "turn", "attrs", "started", "_wall", "_cpu", "_tracer")
+
+    def __init__(self, tracer, name, attrs):
+        self.name = name
+        self.turn = _turn.get()
+        self.attrs = attrs
+        self.started = time.time()
+        self._tracer = tracer
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def end(self):
+        if self._tracer is None:
+            return  # already ended
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        tracer, self._tracer = self._tracer, None
+        tracer._record(self, wall, cpu)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.end()
+        return False
+
+
+class _NullSpan:
+    """Stand-in returned while tracing is disabled; every method is a no-op"""
+
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collects finished spans: appends them to a JSONL file and keeps
+    per-stage counters and latency histograms for the metrics endpoint.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1) if path else None
+        self._turns = 0
+        self._stats = {}  # span name -> [count, wall sum, cpu sum, bucket counts]
+        self._recent = {}  # turn -> {span name: wall seconds}
+        self._server = None
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def new_turn(self):
+        """Allocate the next turn id and make it current for this thread or task"""
+        with self._lock:
+            self._turns += 1
+            turn = self._turns
+            self._recent[turn] = {}
+            if len(self._recent) > RECENT_TURNS:
+                del self._recent[min(self._recent)]
+        _turn.set(turn)
+        return turn
+
+    def turn_summary(self, turn):
+        """{span name: total wall seconds} for a recent turn"""
+        with self._lock:
+            return dict(self._recent.get(turn, {}))
+
+    def _record(self, span, wall, cpu):
+        record = {
+            "turn": span.turn,
+            "span": span.name,
+            "start": round(span.started, 6),
+            "wall_ms": round(wall * 1000, 3),
+            "cpu_ms": round(cpu * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        record.update(span.attrs)
+        line = json.dumps(record, default=str)
+
+        with self._lock:
+            stats = self._stats.get(span.name)
+            if stats is None:
+                stats = self._stats[span.name] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+            stats[0] += 1
+            stats[1] += wall
+            stats[2] += cpu
+            for i, bound in enumerate(BUCKETS):
+                if wall <= bound:
+                    stats[3][i] += 1
+            totals = self._recent.get(span.turn)
+            if totals is not None:
+                totals[span.name] = totals.get(span.name, 0.0) + wall
+            if self._file is not None:
+                self._file.write(line + "\n")
+
+    def metrics(self):
+        """Prometheus text exposition of the per-stage histograms"""
+        with self._lock:
+            stats = {name: (s[0], s[1], s[2], list(s[3])) for name, s in sorted(self._stats.items())}
+            turns = self._turns
+
+        lines = [
+            "# HELP megan_turns_total Conversation turns started.",
+            "# TYPE megan_turns_total counter",
+            f"megan_turns_total {turns}",
+            "# HELP megan_stage_wall_seconds Wall time per pipeline stage.",
+            "# TYPE megan_stage_wall_seconds histogram",
+        ]
+        for name, (count, wall, _, buckets) in stats.items():
+            for bound, n in zip(BUCKETS, buckets):
+                lines.append(f'megan_stage_wall_seconds_bucket{{stage="{name}",le="{bound}"}} {n}')
+            lines.append(f'megan_stage_wall_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'megan_stage_wall_seconds_sum{{stage="{name}"}} {wall:.6f}')
+            lines.append(f'megan_stage_wall_seconds_count{{stage="{name}"}} {count}')
+        lines.append("# HELP megan_stage_cpu_seconds_total CPU time per pipeline stage (calling thread).")
+        lines.append("# TYPE megan_stage_cpu_seconds_total counter")
+        for name, (_, _, cpu, _) in stats.items():
+            lines.append(f'megan_stage_cpu_seconds_total{{stage="{name}"}} {cpu:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port, host="127.0.0.1"):
+        """Serve metrics() at http://host:port/metrics from a daemon thread"""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = tracer.metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="megan-metrics", daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Active tracer; None means tracing is off and span() costs one global lookup
+_tracer = None
+
+
+def configure(path=None, metrics_port=None):
+    """Enable tracing to a JSONL file and/or a Prometheus endpoint"""
+    global _tracer
+    shutdown()
+    tracer = Tracer(path)
+    if metrics_port is not None:
+        port = tracer.serve_metrics(metrics_port)
+        print(f"[Metrics at http://127.0.0.1:{port}/metrics]")
+    _tracer = tracer
+    return tracer
+
+
+def configure_from_env():
+    """Enable tracing from MEGAN_TRACE (JSONL path) and MEGAN_METRICS_PORT"""
+    path = os.getenv("MEGAN_TRACE") or None
+    port = os.getenv("MEGAN_METRICS_PORT")
+    if path is None and not port:
+        return None
+    try:
+        return configure(path, int(port) if port else None)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Tracing disabled: {e}")
+        return None
+
+
+def shutdown():
+    """Disable tracing and close the trace file and endpoint"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, **attrs):
+    """Time a stage: `with span("asr", engine="google"):`"""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **attrs)
+
+
+def traced(name):
+    """Decorator form of span()"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def new_turn():
+    """Start a new turn on this thread or task; returns its id (0 while disabled)"""
+    tracer = _tracer
+    if tracer is None:
+        return 0
+    return tracer.new_turn()
+
+
+def current_turn():
+    """Turn this thread's (or task's) spans are attributed to"""
+    return _turn.get()
+
+
+def set_turn(turn):
+    """Attribute this thread's (or task's) following spans to `turn`"""
+    _turn.set(turn)
+
+
+def in_turn(turn, fn):
+    """Wrap `fn` so spans it records on another thread belong to `turn`"""
+    def wrapper(*args, **kwargs):
+        token = _turn.set(turn)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _turn.reset(token)
+    return wrapper
+
+
+def turn_summary(turn):
+    """{stage: wall seconds} for a recent turn, or {} while disabled"""
+    tracer = _tracer
+    if tracer is None:
+        return {}
+    return tracer.turn_summary(turn)
@@ -0,0 +1,203 @@
+"""
+WAV Decoder Module
+RIFF/WAVE parsing with NumPy views over the PCM payload (no per-sample Python objects)
+"""
+import os
+import struct
+
+import lazy
+
+np = lazy.lazy_import("numpy")
+
+
+# Format tags from the fmt chunk
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Storage dtype per (is_float, bytes per sample); 24-bit samples are kept as raw bytes
+_DTYPES = {
+    (False, 1): 'u1',
+    (False, 2): '<i2',
+    (False, 3): 'u1',
+    (False, 4): '<i4',
+    (True, 4): '<f4',
+    (True, 8): '<f8',
+}
+
+# Full-scale value per integer sample width
+_FULL_SCALE = {1: 128.0, 2: 32768.0, 3: 8388608.0, 4: 2147483648.0}
+
+
+class WavFormat:
+    """Layout of a WAV file's payload: where the samples are and how they are stored.
+
+    8-bit samples are unsigned in WAV files; `signed8` marks raw PCM whose
+    8-bit samples are signed (as in speech_recognition's AudioData).
+    """
+
+    def __init__(self, channels, framerate, sample_width, is_float, data_offset, data_size, signed8=False):
+        self.channels = channels
+        self.framerate = framerate
+        self.sample_width = sample_width
+        self.is_float = is_float
+        self.data_offset = data_offset
+        self.data_size = data_size
+        self.signed8 = signed8
+
+    @property
+    def n_frames(self):
+        return self.data_size // (self.channels * self.sample_width)
+
+    def dtype(self):
+        if self.signed8 and self.sample_width == 1 and not self.is_float:
+            return 'i1'
+        dtype = _DTYPES.get((self.is_float, self.sample_width))
+        if dtype is None:
+            kind = "float" if self.is_float else "PCM"
+            raise ValueError(f"unsupported sample format: {self.sample_width * 8}-bit {kind}")
+        return dtype
+
+    def shape(self):
+        """Shape of the payload view: (frames, channels), plus 3 bytes per 24-bit sample"""
+        if self.sample_width == 3 and not self.is_float:
+            return (self.n_frames, self.channels, 3)
+        return (self.n_frames, self.channels)
+
+
+def _parse_fmt(chunk):
+    if len(chunk) < 16:
+        raise ValueError("fmt chunk too short")
+    tag, channels, framerate, _, _, bits = struct.unpack("<HHIIHH", chunk[:16])
+    if tag == WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+        # The real format tag is the first two bytes of the SubFormat GUID
+        tag = struct.unpack("<H", chunk[24:26])[0]
+    if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise ValueError(f"unsupported WAV format tag 0x{tag:04x} (only PCM and float)")
+    if channels == 0 or bits == 0 or bits % 8:
+        raise ValueError(f"invalid WAV format: {channels} channels, {bits} bits per sample")
+    return channels, framerate, bits // 8, tag == WAVE_FORMAT_IEEE_FLOAT
+
+
+def parse_header(read, total_size):
+    """WavFormat from a RIFF file, given `read(offset, size)` -> bytes and its size"""
+    header = read(0, 12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= total_size:
+        chunk_id, size = struct.unpack("<4sI", read(offset, 8))
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            fmt = _parse_fmt(read(body, size))
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("data chunk before fmt chunk")
+            # Streamed writers leave the size at 0 or 0xFFFFFFFF; take what is there
+            available = total_size - body
+            if size == 0 or size > available:
+                size = available
+            return WavFormat(*fmt, data_offset=body, data_size=size)
+        # Chunks are padded to an even length
+        offset = body + size + (size & 1)
+    raise ValueError("no data chunk")
+
+
+class WavAudio:
+    """Decoded WAV payload.
+
+    `samples` is a NumPy view over the payload bytes (a memory map for
+    files opened with open_wav), shaped (frames, channels); nothing is
+    converted until to_float32() / to_int16() pick a channel.
+    """
+
+    def __init__(self, samples, fmt):
+        self.samples = samples
+        self.format = fmt
+        self.framerate = fmt.framerate
+        self.channels = fmt.channels
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.framerate if self.framerate else 0.0
+
+    def _channel(self, channel):
+        """One channel as its native integer or float values (24-bit unpacked to int32)"""
+        data = self.samples[:, channel]
+        if self.format.sample_width == 3 and not self.format.is_float:
+            # Little-endian 3-byte samples: place them in the top bytes of an int32
+            widened = np.zeros((len(data), 4), dtype='u1')
+            widened[:, 1:] = data
+            return widened.view('<i4').reshape(-1) >> 8
+        return data
+
+    def to_float32(self, channel=0):
+        """One channel as float32 in [-1, 1)"""
+        data = self._channel(channel)
+        if self.format.is_float:
+            return data.astype('float32')
+        width = self.format.sample_width
+        if width == 1 and not self.format.signed8:
+            return (data.astype('float32') - 128.0) / 128.0
+        return data.astype('float32') / _FULL_SCALE[width]
+
+    def to_int16(self, channel=0):
+        """One channel as int16 (a view, without copying, for 16-bit files)"""
+        data = self._channel(channel)
+        width = self.format.sample_width
+        if self.format.is_float:
+            return (np.clip(data, -1.0, 32767 / 32768) * 32768).astype('int16')
+        if width == 1:
+            data = data.astype('int16')
+            return data << 8 if self.format.signed8 else (data - 128) << 8
+        if width == 2:
+            return data
+        return (data >> (8 * (width - 2))).astype('int16')
+
+
+def _view(buffer, fmt):
+    count = int(np.prod(fmt.shape()))
+    flat = np.frombuffer(buffer, dtype=fmt.dtype(), count=count, offset=fmt.data_offset)
+    return flat.reshape(fmt.shape())
+
+
+def decode(data):
+    """WavAudio over WAV bytes (bytes, bytearray or memoryview), without copying the payload"""
+    buffer = memoryview(data).cast('B')
+    fmt = parse_header(lambda offset, size: bytes(buffer[offset:offset + size]), len(buffer))
+    return WavAudio(_view(buffer, fmt), fmt)
+
+
+def from_pcm(frame_data, framerate, sample_width, channels=1):
+    """WavAudio over raw little-endian signed PCM (e.g. speech_recognition's
+    AudioData.frame_data, whose 8-bit samples are signed, unlike WAV's)"""
+    buffer = memoryview(frame_data).cast('B')
+    fmt = WavFormat(channels, framerate, sample_width, False, 0, len(buffer), signed8=True)
+    return WavAudio(_view(buffer, fmt), fmt)
+
+
+def open_wav(source):
+    """WavAudio for a path (memory-mapped) or a binary file object.
+
+    Only the chunk headers are read up front; the OS pages samples in as
+    they are used, so large recordings cost no more memory than the part
+    being analysed.
+    """
+    if not isinstance(source, (str, bytes, os.PathLike)):
+        return decode(source.read())
+
+    with open(source, "rb") as f:
+        def read(offset, size):
+            f.seek(offset)
+            return f.read(size)
+        fmt = parse_header(read, os.fstat(f.fileno()).st_size)
+
+    if fmt.n_frames == 0:
+        return WavAudio(np.zeros(fmt.shape(), dtype=fmt.dtype()), fmt)
+    samples = np.memmap(source, dtype=fmt.dtype(), mode="r", offset=fmt.data_offset, shape=fmt.shape())
+    return WavAudio(samples, fmt)